@@ -0,0 +1,133 @@
+"""Benchmark genhtml over synthetic documents of growing size.
+
+Each document mixes the kinds of blocks found in real documents:
+header-less prints, chains of global-env blocks, isolate-env blocks,
+pillow images and large text outputs.
+Each size is compiled in its own process, so peak memory is measured independently.
+
+Usage:
+
+    python benchmarks/run.py --save benchmarks/baseline.json
+    python benchmarks/run.py --compare benchmarks/baseline.json
+
+Timings depend on the machine, so baselines are not shared: save one
+before a change, and compare with it after. Comparing with a missing
+baseline only prints the results.
+
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import resource
+import multiprocessing
+
+# benchmark the working tree, not an installed version
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+BLOCKS = {
+    'print': '```genhtml header=none\nprint("<b>block {idx}</b>")\n```',
+    'global-env': '```genhtml header=none global-env=true\ntotal = globals().get("total", 0) + {idx}\nprint(total)\n```',
+    'isolate-env': '```genhtml header=none global-env=true isolate-env=true\nitems = [{idx}] * 100\nprint(len(items))\n```',
+    'image': ('```genhtml header=none footer=png-image format=png\nfrom PIL import Image\n'
+              'image = Image.new("RGB", (64, 64), color=({idx} % 256, 0, 0))\n```'),
+    'large-text': '```genhtml header=none\nprint("<p>" + "lorem ipsum " * 10000 + "</p>")\n```',
+}
+
+
+def kinds() -> [str]:
+    "Return kinds of blocks available in this environment"
+    try:
+        import PIL
+    except ImportError:
+        return [kind for kind in BLOCKS if kind != 'image']
+    return list(BLOCKS)
+
+
+def synthetic_document(size:int, seed:int=0) -> str:
+    "Return a markdown document with given number of blocks of all kinds"
+    rng, available = random.Random(seed), kinds()
+    parts = []
+    for idx in range(size):
+        parts.append(f'## Section {idx}\n\nSome text about section {idx}.')
+        parts.append(BLOCKS[rng.choice(available)].format(idx=idx))
+    return '\n\n'.join(parts) + '\n'
+
+
+def measure(size:int, config:dict, queue:multiprocessing.Queue):
+    "Compile a document of given size, and put its measures in queue"
+    import markdown
+    from genhtml import GenHTMLMarkdownExtension
+    source = synthetic_document(size)
+    md = markdown.Markdown(extensions=[GenHTMLMarkdownExtension(**config)])
+    start = time.perf_counter()
+    html = md.convert(source)
+    duration = time.perf_counter() - start
+    queue.put({
+        'size': size, 'seconds': duration, 'blocks_per_second': size / duration,
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'input_bytes': len(source), 'output_bytes': len(html),
+    })
+
+
+def run(sizes:[int], config:dict) -> [dict]:
+    results = []
+    for size in sizes:
+        queue = multiprocessing.Queue()
+        proc = multiprocessing.Process(target=measure, args=(size, config, queue))
+        proc.start()
+        proc.join()
+        if proc.exitcode:
+            sys.exit(f"Benchmark of {size} blocks failed")
+        results.append(queue.get())
+        result = results[-1]
+        print(f"{size:>6} blocks: {result['seconds']:8.3f}s, {result['blocks_per_second']:9.1f} blocks/s,"
+              f" {result['peak_rss_kb'] / 1024:8.1f} MB peak RSS", flush=True)
+    return results
+
+
+def compare(results:[dict], baseline:[dict], tolerance:float) -> bool:
+    "Print regressions against baseline, return true if there is none"
+    ok = True
+    baseline = {result['size']: result for result in baseline}
+    for result in results:
+        reference = baseline.get(result['size'])
+        if reference is None:
+            continue
+        for measure in ('seconds', 'peak_rss_kb'):
+            ratio = result[measure] / reference[measure]
+            if ratio > 1 + tolerance:
+                print(f"REGRESSION at {result['size']} blocks: {measure} is {ratio:.2f}x the baseline")
+                ok = False
+    return ok
+
+
+def parse_cli(args:[str]=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000, 10000],
+                        help="numbers of blocks of the benchmarked documents")
+    parser.add_argument('--config', type=json.loads, default={},
+                        help="genhtml extension options, as a JSON object")
+    parser.add_argument('--save', help="JSON file where results are written")
+    parser.add_argument('--compare', help="JSON file of results to compare with")
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help="relative slowdown or memory increase considered as a regression")
+    return parser.parse_args(args)
+
+
+if __name__ == '__main__':
+    args = parse_cli()
+    results = run(args.sizes, args.config)
+    if args.save:
+        with open(args.save, 'w') as fd:
+            json.dump(results, fd, indent=2)
+    if args.compare and not os.path.exists(args.compare):
+        print(f"No baseline at {args.compare}, nothing to compare with."
+              f" Save one with: python {sys.argv[0]} --save {args.compare}")
+    elif args.compare:
+        with open(args.compare) as fd:
+            if not compare(results, json.load(fd), args.tolerance):
+                sys.exit(1)
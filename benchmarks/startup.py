@@ -0,0 +1,42 @@
+"""Measure the startup time of markdown with genhtml on a trivial document.
+
+Usage:
+
+    python benchmarks/startup.py --runs 20
+
+"""
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DOCUMENT = '# Title\n\n```genhtml header=none\nprint("hello")\n```\n'
+
+
+def measure(runs:int) -> [float]:
+    "Return the duration of each run of markdown on a trivial document"
+    env = dict(os.environ, PYTHONPATH=ROOT)  # benchmark the working tree
+    with tempfile.NamedTemporaryFile('w', suffix='.mkd') as fd:
+        fd.write(DOCUMENT)
+        fd.flush()
+        durations = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, '-m', 'markdown', '-x', 'genhtml', fd.name],
+                           env=env, check=True, stdout=subprocess.DEVNULL)
+            durations.append(time.perf_counter() - start)
+    return durations
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=20, help="number of runs")
+    durations = measure(parser.parse_args().runs)
+    print(f"median {statistics.median(durations) * 1000:.1f}ms, min {min(durations) * 1000:.1f}ms"
+          f" over {len(durations)} runs")
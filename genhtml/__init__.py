@@ -1,3 +1,14 @@
 from .genhtml import *
 
 __version__ = '1.0.10.dev0'
+
+
+def __getattr__(name:str):
+    "Import compile_many and render on first use, as markdown only needs the extension"
+    if name == 'compile_many':
+        from .batch import compile_many
+        return compile_many
+    if name == 'render':
+        from .aio import render
+        return render
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
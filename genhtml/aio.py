@@ -0,0 +1,86 @@
+"""Rendering of markdown documents from asyncio code, e.g. a web server.
+
+    html = await genhtml.render(text, cache_dir='cache')
+
+Documents are converted by a pool of threads, so the event loop is not blocked
+while blocks run. Outputs are captured per thread (see genhtml.capture),
+so documents rendered concurrently do not mix their outputs.
+At most MAX_CONCURRENCY documents are converted at once, per event loop
+(see set_max_concurrency); the other renders wait their turn without occupying a thread.
+Markdown instances are reused across renders with the same config,
+one document at a time.
+
+"""
+
+import os
+import json
+import threading
+import weakref
+import markdown
+from .genhtml import GenHTMLMarkdownExtension
+
+
+MAX_CONCURRENCY = os.cpu_count() or 1  # changed with set_max_concurrency
+_executor = None
+_semaphores = weakref.WeakKeyDictionary()  # event loop -> semaphore limiting renders
+_instances = {}  # config -> idle markdown instances
+_lock = threading.Lock()
+
+
+def set_max_concurrency(count:int):
+    """Set how many documents are converted at once, per event loop.
+    Renders already started finish in the previous threads, without counting against the new limit"""
+    global MAX_CONCURRENCY, _executor
+    with _lock:
+        MAX_CONCURRENCY = max(1, int(count))
+        executor, _executor = _executor, None
+        _semaphores.clear()
+    if executor:
+        executor.shutdown(wait=False)
+
+
+def convert(text:str, config:dict) -> str:
+    "Return the HTML compiled from given markdown text, using an idle markdown instance"
+    key = json.dumps(config, sort_keys=True, default=str)
+    with _lock:
+        idle = _instances.setdefault(key, [])
+        md = idle.pop() if idle else None
+    if md is None:
+        md = markdown.Markdown(extensions=[GenHTMLMarkdownExtension(**config)])
+    try:
+        md.reset()
+        return md.convert(text)
+    finally:
+        with _lock:
+            idle.append(md)
+
+
+async def render(text:str, **config) -> str:
+    """Return the HTML compiled from given markdown text, with given genhtml options.
+    The result is the same as markdown(text, extensions=[GenHTMLMarkdownExtension(**config)])"""
+    import asyncio  # not imported with genhtml, as it is slow to import
+    import concurrent.futures
+    global _executor
+    loop = asyncio.get_event_loop()  # the running loop, get_running_loop is python 3.7+
+    with _lock:
+        if _executor is None:
+            _executor = concurrent.futures.ThreadPoolExecutor(MAX_CONCURRENCY, thread_name_prefix='genhtml')
+        if loop not in _semaphores:
+            _semaphores[loop] = asyncio.Semaphore(MAX_CONCURRENCY)
+    async with _semaphores[loop]:
+        return await loop.run_in_executor(_executor, convert, text, config)
+
+
+def shutdown():
+    """Stop the threads converting documents, after the current renders,
+    and the executor processes and workers of the markdown instances"""
+    global _executor
+    with _lock:
+        executor, _executor = _executor, None
+    if executor:
+        executor.shutdown()
+    with _lock:
+        instances = [md for idle in _instances.values() for md in idle]
+        _instances.clear()
+    for md in instances:
+        md.preprocessors['genhtml'].close()
@@ -0,0 +1,96 @@
+"""Images written as files in an assets directory, instead of being inlined in the HTML.
+
+Files are named after the hash of their content, so identical images
+are written only once, whatever the document or build producing them.
+
+"""
+
+import os
+import hashlib
+import tempfile
+
+
+EXTENSIONS = {'png': 'png', 'gif': 'gif', 'jpg': 'jpg', 'svg': 'svg', 'webp': 'webp', 'avif': 'avif'}  # format -> file extension
+
+
+def img_tag(src:str, alt:str='', title:str='', **attrs) -> str:
+    "Return the img tag of given source, ignoring empty attributes"
+    attrs = ''.join(f' {name}="{value}"' for name, value in (('alt', alt), ('title', title), *attrs.items())
+                    if value)
+    return f'<img src="{src}"{attrs} />'
+
+
+def asset_name(digest:str, format:str) -> str:
+    return f"{digest[:32]}.{EXTENSIONS.get(format, 'png')}"
+
+
+def asset_url(name:str, assets_url:str) -> str:
+    return f"{assets_url.rstrip('/')}/{name}" if assets_url else name
+
+
+def write_asset(data:bytes, format:str, assets_dir:str) -> str:
+    "Write given data in assets directory if not already there, return its file name"
+    name = asset_name(hashlib.sha256(data).hexdigest(), format)
+    path = os.path.join(assets_dir, name)
+    if not os.path.exists(path):
+        os.makedirs(assets_dir, exist_ok=True)
+        with tempfile.NamedTemporaryFile('wb', dir=assets_dir, delete=False) as fd:
+            fd.write(data)
+        os.chmod(fd.name, 0o644)  # temporary files are only readable by their owner
+        os.replace(fd.name, path)
+    return name
+
+
+class AssetOutput:
+    """Receive raw bytes written by python code with emit_bytes(data, format),
+    and stream them to a file of the assets directory.
+
+    Same interface as genhtml.BinaryOutput, but data is hashed and written as it comes.
+
+    """
+
+    def __init__(self, assets_dir:str, assets_url:str=''):
+        self.assets_dir = assets_dir
+        self.assets_url = assets_url
+        self.format = None
+        self._file = None
+        self._hash = hashlib.sha256()
+
+    def __bool__(self):
+        return self._file is not None
+
+    def emit_bytes(self, data:bytes, format:str=None):
+        "Add given bytes to the image, with given format (png, gif, jpg or svg)"
+        if format:
+            self.format = format.lower()
+        if self._file is None:
+            os.makedirs(self.assets_dir, exist_ok=True)
+            self._file = tempfile.NamedTemporaryFile('w+b', dir=self.assets_dir, delete=False)
+        self._file.write(data)
+        self._hash.update(data)
+
+    def to_html(self, alt:str='', title:str='', format:str='png', **attrs) -> str:
+        "Return the img tag showing received data"
+        self._file.close()
+        name = asset_name(self._hash.hexdigest(), self.format or format)
+        path = os.path.join(self.assets_dir, name)
+        if os.path.exists(path):  # already written by another block or document
+            os.remove(self._file.name)
+        else:
+            os.chmod(self._file.name, 0o644)
+            os.replace(self._file.name, path)
+        return img_tag(asset_url(name, self.assets_url), alt, title, **attrs)
+
+    def getvalue(self) -> bytes:
+        "Return received data, and forget it"
+        self._file.seek(0)
+        data = self._file.read()
+        self.discard()
+        return data
+
+    def discard(self):
+        "Forget received data"
+        if self._file is not None:
+            self._file.close()
+            os.remove(self._file.name)
+            self._file = None
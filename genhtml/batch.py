@@ -0,0 +1,166 @@
+"""Compilation of many markdown documents at once.
+
+Headers, footers and the markdown instance are loaded once per process,
+and documents are compiled by a pool of processes.
+Documents whose output is newer than them and their dependencies are skipped.
+Outputs keep the layout of documents, relatively to the directory containing them all.
+
+Usage:
+
+    genhtml -o output/ -j 4 content/*.mkd
+
+"""
+
+import os
+import json
+import glob
+import time
+import logging
+import markdown
+from .genhtml import GenHTMLMarkdownExtension, GenHTMLPreprocessor, LIBDIR
+from .blocks import ARG_RE
+
+
+logger = logging.getLogger(__name__)
+_markdown = None  # markdown instance of the current process
+
+
+def _init_markdown(config:dict):
+    global _markdown
+    _markdown = markdown.Markdown(extensions=[GenHTMLMarkdownExtension(**config)])
+
+
+def _close_markdown():
+    "Stop the executor process and the workers of the markdown instance of the current process"
+    global _markdown
+    if _markdown is not None:
+        _markdown.preprocessors['genhtml'].close()
+        _markdown = None
+
+
+def _init_pool_process(config:dict):
+    "Load the markdown instance of a pool process, closed when the process exits"
+    import multiprocessing.util
+    _init_markdown(config)
+    # pool processes exit without running atexit handlers, but run these finalizers
+    multiprocessing.util.Finalize(None, _close_markdown, exitpriority=10)
+
+
+def common_root(paths:[str]) -> str:
+    "Return the deepest directory containing all given files"
+    return os.path.commonpath([os.path.dirname(os.path.abspath(path)) for path in paths]) if paths else '.'
+
+
+def output_path(path:str, out_dir:str, root:str=None) -> str:
+    """Return the path of the HTML file compiled from given markdown file,
+    at the same place in out_dir as the file in root (its directory by default)"""
+    path = os.path.abspath(path)
+    relpath = os.path.relpath(path, root or os.path.dirname(path))
+    return os.path.join(out_dir, os.path.splitext(relpath)[0] + '.html')
+
+
+def dependencies(config:dict) -> [str]:
+    "Yield files that all documents depend on, i.e. headers and footers"
+    directories = [os.path.join(LIBDIR, 'headers'), os.path.join(LIBDIR, 'footers'),
+                   config.get('headers_dir'), config.get('footers_dir')]
+    for directory in filter(None, directories):
+        yield from glob.glob(os.path.join(directory, '*.py'))
+
+
+def block_dependencies(path:str) -> [str]:
+    "Yield files listed by the cache-deps option of blocks in given markdown file"
+    with open(path, encoding='utf-8') as fd:
+        text = fd.read()
+    for match in GenHTMLPreprocessor.BLOCK_RE.finditer(text):
+        for field, _, value in ARG_RE.findall(match.group('args')):
+            if field == 'cache-deps':
+                for pattern in filter(None, value.split(',')):
+                    yield from glob.glob(os.path.expanduser(pattern), recursive=True)
+
+
+def is_outdated(path:str, output:str, deps:[str]=()) -> bool:
+    """True if output does not exist or is older than given markdown file,
+    dependencies, or files read by its blocks (see block_dependencies)"""
+    if not os.path.exists(output):
+        return True
+    mtime = os.path.getmtime(output)
+    return any(os.path.getmtime(dep) >= mtime for dep in (path, *deps, *block_dependencies(path)))
+
+
+def compile_file(path:str, output:str) -> float:
+    "Compile given markdown file into given output file, return the time spent"
+    start = time.perf_counter()
+    with open(path, encoding='utf-8') as fd:
+        source = fd.read()
+    _markdown.reset()
+    html = _markdown.convert(source)
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as fd:
+        fd.write(html)
+    return time.perf_counter() - start
+
+
+def compile_many(paths:[str], out_dir:str, jobs:int=1, config:dict=None, force:bool=False) -> dict:
+    """Compile given markdown files into HTML files in out_dir,
+    in the same subdirectories as in the directory containing them all.
+
+    jobs -- number of processes compiling documents in parallel
+    config -- options given to the genhtml extension
+    force -- if true, up-to-date outputs are compiled again
+
+    Return a mapping from each path to the seconds spent compiling it,
+    or None if it was up-to-date.
+
+    """
+    config = dict(config or {})
+    os.makedirs(out_dir, exist_ok=True)
+    deps = tuple(dependencies(config))
+    root = common_root(paths)
+    outputs = {path: output_path(path, out_dir, root) for path in paths}
+    timings = {path: None for path in paths}
+    todo = [path for path in paths if force or is_outdated(path, outputs[path], deps)]
+    for path in set(paths) - set(todo):
+        logger.info(f"{path}: up-to-date")
+    if jobs > 1 and len(todo) > 1:
+        import concurrent.futures  # not imported with genhtml, as it is slow to import
+        with concurrent.futures.ProcessPoolExecutor(jobs, initializer=_init_pool_process,
+                                                    initargs=(config,)) as pool:
+            futures = {path: pool.submit(compile_file, path, outputs[path]) for path in todo}
+            for path, future in futures.items():
+                timings[path] = future.result()
+                logger.info(f"{path}: compiled in {timings[path]:.3f}s")
+    elif todo:
+        _init_markdown(config)
+        try:
+            for path in todo:
+                timings[path] = compile_file(path, outputs[path])
+                logger.info(f"{path}: compiled in {timings[path]:.3f}s")
+        finally:
+            _close_markdown()
+    return timings
+
+
+def parse_cli(args:[str]=None) -> 'argparse.Namespace':
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('paths', nargs='+', help="markdown files to compile")
+    parser.add_argument('-o', '--out-dir', default='.', help="directory where HTML files are written")
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(), help="number of processes")
+    parser.add_argument('-c', '--config', help="JSON file of genhtml extension options"
+                        ", either at root or under a 'genhtml' key")
+    parser.add_argument('-f', '--force', action='store_true', help="compile up-to-date files too")
+    return parser.parse_args(args)
+
+
+def main(args:[str]=None):
+    args = parse_cli(args)
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    config = {}
+    if args.config:
+        with open(args.config) as fd:
+            config = json.load(fd)
+        config = config.get('genhtml', config)
+    timings = compile_many(args.paths, args.out_dir, jobs=args.jobs, config=config, force=args.force)
+    compiled = {path: timing for path, timing in timings.items() if timing is not None}
+    logger.info(f"{len(compiled)} compiled, {len(timings) - len(compiled)} up-to-date"
+                f", {sum(compiled.values()):.3f}s of compilation")
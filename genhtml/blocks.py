@@ -0,0 +1,106 @@
+"""Parsed blocks of a document, without running them.
+
+A BlockSpec records where a block is, its options and the hash of its code.
+Options are parsed by the OPTIONS table, mapping each option name
+to the BlockSpec attribute it sets and the function converting its value.
+
+"""
+
+import re
+import logging
+from .cache import hash_parts
+
+
+logger = logging.getLogger(__name__)
+FALSY_VALUES = {'0', 'no', 'false', 'f'}
+GLOBAL_ENV_OPTIONS = {'global-env', 'global'}
+ISOLATE_ENV_OPTIONS = {'isolate-env', 'isolated-env', 'isolated'}
+ARG_RE = re.compile(r'''(?P<field>[\w-]+)=(?P<quote>"|'|)(?P<value>[a-zA-Z0-9,+_*./-]+)(?P=quote)''')
+
+
+def as_bool(value:str) -> bool:
+    return value.lower() not in FALSY_VALUES
+
+
+def as_names(value:str) -> tuple:
+    return tuple(value.split(','))
+
+
+def as_number(value:str) -> float:
+    return float(value)
+
+
+def as_quality(value:str) -> int:
+    quality = int(value)
+    if not 1 <= quality <= 100:
+        raise ValueError(f"quality must be between 1 and 100, not {quality}")
+    return quality
+
+
+def as_numbers(value:str) -> tuple:
+    return tuple(int(number) for number in value.split(','))
+
+
+OPTIONS = {  # option -> (attribute, converter)
+    'header': ('headers', as_names),
+    'footer': ('footers', as_names),
+    'interpret': ('interpret', as_bool),
+    'format': ('format', str.lower),
+    'alt': ('alt', str),
+    'title': ('title', str),
+    **{option: ('global_env', as_bool) for option in GLOBAL_ENV_OPTIONS},
+    **{option: ('isolate_env', as_bool) for option in ISOLATE_ENV_OPTIONS},
+    'cache': ('cache', as_bool),
+    'pure': ('pure', as_bool),
+    'cache-deps': ('cache_deps', lambda value: tuple(filter(None, value.split(',')))),
+    'width': ('width', str),
+    'height': ('height', str),
+    'max-width': ('max_width', int),
+    'quality': ('quality', as_quality),
+    'srcset': ('srcset', as_numbers),
+    'timeout': ('timeout', as_number),
+    'memory': ('memory', as_number),
+}
+
+
+class BlockSpec:
+    """Position, options and code of a block.
+
+    start, end -- offsets of the block in the text
+    line -- line of the block in the document
+    code -- code of the block, without headers and footers
+    source_hash -- hash of the block options and code
+    timeout, memory -- limits of the block, or None to use the defaults of the extension
+
+    Other attributes are the block options, see genhtml.genhtml.
+
+    """
+    __slots__ = ('start', 'end', 'line', 'code', 'source_hash', 'headers', 'footers', 'interpret', 'format',
+                 'alt', 'title', 'global_env', 'isolate_env', 'cache', 'pure', 'cache_deps', 'width', 'height',
+                 'max_width', 'quality', 'srcset', 'timeout', 'memory')
+
+    def __init__(self, start:int, end:int, line:int, args:str, code:str, format:str='html'):
+        self.start, self.end, self.line, self.code = start, end, line, code
+        self.source_hash = hash_parts(args, code) if format == 'html' else hash_parts(args, code, format)
+        self.headers, self.footers = ('',), ('',)
+        self.interpret, self.global_env, self.isolate_env, self.cache, self.pure = True, False, False, True, False
+        self.format, self.alt, self.title, self.width, self.height = format, '', '', '', ''
+        self.cache_deps = ()
+        self.max_width, self.quality, self.srcset = 0, 0, ()
+        self.timeout = self.memory = None
+        for key, _, value in ARG_RE.findall(args):
+            self.set_option(key, value)
+
+    def set_option(self, key:str, value:str):
+        "Set given option, or warn if it is unknown or its value invalid"
+        if key not in OPTIONS:
+            logger.warning(f"Unrecognized option '{key}' with value '{value}'")
+            return
+        attribute, convert = OPTIONS[key]
+        try:
+            setattr(self, attribute, convert(value))
+        except ValueError:
+            logger.warning(f"Invalid value '{value}' for option '{key}'. It will be ignored")
+
+    def __repr__(self):
+        return f"<BlockSpec line {self.line}: {', '.join(self.headers)} | {self.format}>"
@@ -0,0 +1,118 @@
+"""Persistent, content-addressed storage of block outputs.
+
+Entries are files named after the hash of what produced them,
+so that a cache directory can be shared among builds and documents.
+Least recently used entries are removed when the directory grows over its size limit.
+
+"""
+
+import os
+import glob
+import hashlib
+import logging
+import tempfile
+import functools
+import contextlib
+
+
+logger = logging.getLogger(__name__)
+
+
+def hash_parts(*parts:str) -> str:
+    "Return the hex digest of given parts joined by newlines"
+    digest = hashlib.sha256()
+    for idx, part in enumerate(parts):
+        if idx:
+            digest.update(b'\n')
+        digest.update(part.encode())
+    return digest.hexdigest()
+
+
+def dependencies_fingerprint(patterns:[str]) -> [str]:
+    """Yield one string per file matched by given glob patterns,
+    changing whenever the file content changes"""
+    for pattern in patterns:
+        for fname in sorted(glob.glob(os.path.expanduser(pattern), recursive=True)):
+            if not os.path.isfile(fname):
+                continue
+            digest = hashlib.sha256()
+            with open(fname, 'rb') as fd:
+                for chunk in iter(lambda: fd.read(1 << 16), b''):
+                    digest.update(chunk)
+            yield f'{fname}:{digest.hexdigest()}'
+
+
+class BlockCache:
+    """Map keys (see hash_parts) to block outputs, stored in given directory.
+
+    max_bytes -- if non-zero, maximal size of stored entries.
+                 Least recently used entries are dropped to respect it.
+
+    """
+
+    def __init__(self, directory:str, max_bytes:int=0):
+        self.directory = os.path.expanduser(directory)
+        self.max_bytes = int(max_bytes or 0)
+        os.makedirs(self.directory, exist_ok=True)
+        self.size = sum(os.path.getsize(fname) for fname in self._entries())
+
+    def _entries(self) -> [str]:
+        return glob.glob(os.path.join(self.directory, '??', '*'))
+
+    def _path(self, key:str) -> str:
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, key:str, default=None, binary:bool=False) -> str or bytes:
+        "Return the output stored for given key, or default"
+        path = self._path(key)
+        try:
+            with open(path, 'rb' if binary else 'r') as fd:
+                value = fd.read()
+        except FileNotFoundError:
+            return default
+        os.utime(path)  # entry is now the most recently used
+        return value
+
+    def set(self, key:str, value:str or bytes):
+        "Store given output (text or bytes) under given key"
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if os.path.exists(path):
+            self.size -= os.path.getsize(path)
+        # write in a temporary file first, so concurrent builds never read partial entries
+        with tempfile.NamedTemporaryFile('wb' if isinstance(value, bytes) else 'w', dir=os.path.dirname(path), delete=False) as fd:
+            fd.write(value)
+        os.replace(fd.name, path)
+        self.size += os.path.getsize(path)
+        if self.max_bytes and self.size > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        "Remove least recently used entries until size limit is respected"
+        entries = []
+        for fname in self._entries():
+            try:
+                stat = os.stat(fname)
+            except FileNotFoundError:  # removed by a concurrent build
+                continue
+            entries.append((stat.st_mtime, stat.st_size, fname))
+        entries.sort()
+        self.size = sum(size for _, size, _ in entries)
+        for _, size, fname in entries:
+            if self.size <= self.max_bytes:
+                break
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(fname)
+            self.size -= size
+        logger.debug(f"Cache {self.directory} evicted down to {self.size} bytes")
+
+
+def subdirectory(cache_dir:str, name:str) -> str or None:
+    "Return the subdirectory of given cache directory where code, graphviz, images or data files are kept"
+    return os.path.join(cache_dir, name) if cache_dir else None
+
+
+@functools.lru_cache(maxsize=None)
+def shared_cache(directory:str) -> BlockCache:
+    "Return the unbounded BlockCache of given directory, created once per process"
+    return BlockCache(directory)
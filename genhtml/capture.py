@@ -0,0 +1,66 @@
+"""Capture of the standard output of python codes, per thread.
+
+contextlib.redirect_stdout replaces sys.stdout for the whole process,
+so codes run concurrently by several threads would print in each other's output.
+Instead, while at least one capture is active, sys.stdout is replaced by a proxy
+writing in the target of the current thread, or in the original stdout
+for threads that capture nothing.
+
+Note that threads started by a captured code print in the original stdout.
+
+"""
+
+import sys
+import threading
+import contextlib
+
+
+class ThreadLocalStdout:
+    "Stream writing in the target set by the current thread, or in the default stream"
+
+    def __init__(self, default):
+        self.default = default
+        self._local = threading.local()
+
+    @property
+    def target(self):
+        return getattr(self._local, 'target', None) or self.default
+
+    @target.setter
+    def target(self, stream):
+        self._local.target = stream
+
+    def write(self, text:str) -> int:
+        return self.target.write(text)
+
+    def flush(self):
+        return self.target.flush()
+
+    def __getattr__(self, attr:str):
+        return getattr(self.target, attr)
+
+
+_lock = threading.Lock()
+_proxy = None  # installed as sys.stdout while captures are active
+_active = 0  # number of active captures
+
+
+@contextlib.contextmanager
+def capture_stdout(stream):
+    "Write in given stream what the current thread prints"
+    global _proxy, _active
+    with _lock:
+        if sys.stdout is not _proxy:  # first capture, or stdout replaced meanwhile
+            _proxy = sys.stdout = ThreadLocalStdout(sys.stdout)
+        _active += 1
+        proxy = _proxy
+    previous = getattr(proxy._local, 'target', None)  # nested captures
+    proxy.target = stream
+    try:
+        yield stream
+    finally:
+        proxy.target = previous
+        with _lock:
+            _active -= 1
+            if not _active and sys.stdout is proxy:
+                sys.stdout, _proxy = proxy.default, None
@@ -0,0 +1,90 @@
+"""Plotly charts sharing a single plotly.js library per document.
+
+plotly.offline.plot embeds the whole library (megabytes of javascript) in each chart.
+Instead, plot_div renders a chart as an empty div and its figure as JSON,
+and include_library inserts once, before the first chart of a document,
+the library and a script drawing all charts, according to the plotly_js option:
+
+    inline-once -- the library is inlined once per document
+    cdn -- the library is loaded from the plotly CDN
+    file -- the library is written once in the assets directory, shared by all documents
+    none -- the library is loaded by the page template, only the drawing script is inserted
+
+With lazy loading, charts are drawn when they are scrolled into view.
+
+"""
+
+import os
+import logging
+import tempfile
+from .assets import asset_url
+
+
+logger = logging.getLogger(__name__)
+CHART_CLASS = 'genhtml-plotly'
+PLOTLY_JS_MODES = {'inline-once', 'cdn', 'file', 'none'}
+DRAW_SCRIPT = '''<script>document.addEventListener('DOMContentLoaded', function () {
+  function draw(div) {
+    var figure = JSON.parse(document.querySelector('script[data-chart="' + div.id + '"]').textContent);
+    Plotly.newPlot(div, figure.data, figure.layout, figure.config || {responsive: true});
+  }
+  var charts = document.querySelectorAll('div.%(class)s');
+  if (%(lazy)s && 'IntersectionObserver' in window) {
+    var observer = new IntersectionObserver(function (entries) {
+      entries.forEach(function (entry) {
+        if (entry.isIntersecting) { observer.unobserve(entry.target); draw(entry.target); }
+      });
+    });
+    charts.forEach(function (div) { observer.observe(div); });
+  } else {
+    charts.forEach(draw);
+  }
+});</script>'''
+
+
+def plot_div(figure) -> str:
+    "Return the HTML of given plotly figure (or figure dict), drawn by the script of include_library"
+    import uuid
+    import plotly.io
+    chart_id = f'chart-{uuid.uuid4().hex}'
+    spec = plotly.io.to_json(figure).replace('</', '<\\/')  # do not end the script tag
+    return (f'<div class="{CHART_CLASS}" id="{chart_id}"></div>\n'
+            f'<script type="application/json" data-chart="{chart_id}">{spec}</script>')
+
+
+def library_tags(mode:str='inline-once', lazy:bool=False, assets_dir:str='', assets_url:str='') -> str:
+    "Return the script tags loading plotly.js according to given mode, and drawing the charts"
+    draw = DRAW_SCRIPT % {'class': CHART_CLASS, 'lazy': 'true' if lazy else 'false'}
+    if mode == 'none':
+        return draw
+    import plotly.offline
+    version = plotly.offline.get_plotlyjs_version()
+    if mode == 'cdn':
+        return f'<script src="https://cdn.plot.ly/plotly-{version}.min.js" charset="utf-8"></script>\n{draw}'
+    if mode == 'file' and assets_dir:
+        name = f'plotly-{version}.min.js'
+        path = os.path.join(assets_dir, name)
+        if not os.path.exists(path):  # written once for the whole build
+            os.makedirs(assets_dir, exist_ok=True)
+            with tempfile.NamedTemporaryFile('w', dir=assets_dir, encoding='utf-8', delete=False) as fd:
+                fd.write(plotly.offline.get_plotlyjs())
+            os.chmod(fd.name, 0o644)  # temporary files are only readable by their owner
+            os.replace(fd.name, path)
+        return f'<script src="{asset_url(name, assets_url)}" charset="utf-8"></script>\n{draw}'
+    if mode == 'file':
+        logger.warning("plotly_js=file needs the assets_dir option. plotly.js will be inlined instead")
+    return f'<script type="text/javascript">{plotly.offline.get_plotlyjs()}</script>\n{draw}'
+
+
+def first_chart(html:str) -> int:
+    "Return the position of the first chart of given HTML, or -1 if there is none"
+    return html.find(f'<div class="{CHART_CLASS}"')
+
+
+def include_library(html:str, mode:str='inline-once', lazy:bool=False,
+                    assets_dir:str='', assets_url:str='') -> str:
+    "Return given HTML with plotly.js inserted before its first chart, if any"
+    first = first_chart(html)
+    if first < 0:
+        return html
+    return html[:first] + library_tags(mode, lazy, assets_dir, assets_url) + '\n' + html[first:]
@@ -0,0 +1,58 @@
+"""Compilation of python codes into code objects, done once per source.
+
+A python code is run in stages: its headers, the block code itself, and its footers.
+Each stage is a tuple (source, filename, directory), compiled only once per process.
+Stages with a directory (headers and footers, when a cache directory is set) are also kept
+in that directory, like __pycache__, so other processes do not compile them again.
+
+"""
+
+import os
+import marshal
+import hashlib
+import logging
+import tempfile
+import functools
+import importlib.util
+
+
+logger = logging.getLogger(__name__)
+CODE_CACHE_SIZE = 4096  # number of code objects kept in memory
+
+
+def headfoot_stage(kind:str, name:str, source:str, directory:str=None) -> tuple:
+    "Return the stage of given header or footer, kept in given directory if any"
+    return source, f'<{kind} {name}>', directory
+
+
+def block_stage(source:str, line:int=None) -> tuple:
+    "Return the stage of the code of a block, named after its line in the document if known"
+    return source, f'<block line {line}>' if line else '<block>', None
+
+
+def stage_path(source:str, filename:str, directory:str) -> str:
+    "Return the path of the file of the compiled stage"
+    digest = hashlib.sha256(importlib.util.MAGIC_NUMBER + f'{filename}\n{source}'.encode()).hexdigest()
+    return os.path.join(directory, f'{digest}.pyc')
+
+
+@functools.lru_cache(maxsize=CODE_CACHE_SIZE)
+def compile_stage(source:str, filename:str, directory:str=None):
+    "Return the code object of given source, read from or written in given directory if any"
+    if not directory:
+        return compile(source, filename, 'exec', dont_inherit=True)
+    path = stage_path(source, filename, directory)
+    try:
+        with open(path, 'rb') as fd:
+            return marshal.load(fd)
+    except (OSError, EOFError, ValueError, TypeError):
+        pass  # not compiled yet, or corrupted
+    code = compile(source, filename, 'exec', dont_inherit=True)
+    try:
+        os.makedirs(directory, exist_ok=True)
+        with tempfile.NamedTemporaryFile('wb', dir=directory, delete=False) as fd:
+            marshal.dump(code, fd)
+        os.replace(fd.name, path)
+    except OSError as err:
+        logger.warning(f"Compiled code of {filename} could not be written in {directory}: {err}")
+    return code
@@ -0,0 +1,104 @@
+"""Loading of data files shared by many blocks, parsed once per build.
+
+Python codes have access to a Loader as the `data` builtin, unless they define that name:
+
+    sales = data.load('data/sales.csv')
+
+Each file is parsed once per process, as long as its modification time and size do not change.
+Only the last version of each file (with given options) is kept in memory.
+With pyarrow installed and a directory given to the Loader (from the cache_dir option),
+parsed tables are also written in Arrow format, and read back as memory-mapped files
+by the other processes (workers, later builds), so they are not parsed again.
+Numeric columns without missing values are used straight from the mapped file,
+shared by all processes; other columns are converted, hence copied, in each process.
+
+Returned dataframes are shallow copies: adding or replacing columns does not modify
+the data seen by other blocks, but modifying values in place does.
+
+"""
+
+import os
+import logging
+from .cache import hash_parts
+
+
+logger = logging.getLogger(__name__)
+_loaded = {}  # (absolute path, options) -> (mtime, size, parsed data), in this process
+
+
+class Loader:
+    "Load data files, keeping parsed tables in given directory, or only in memory if None"
+
+    def __init__(self, directory:str=None):
+        self.directory = directory
+
+    def load(self, path:str, **options):
+        "Return the data of given file, see genhtml.data.load"
+        return load(path, self.directory, **options)
+
+    def __repr__(self):
+        return f"<data loader of {self.directory or 'memory'}>"
+
+
+def _read(path:str, **options):
+    "Return the data of given file, parsed according to its extension"
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.npy':
+        import numpy
+        return numpy.load(path, mmap_mode='r', **options)
+    import pandas
+    if ext == '.tsv':
+        options.setdefault('sep', '\t')
+    readers = {
+        '.csv': pandas.read_csv, '.tsv': pandas.read_csv, '.parquet': pandas.read_parquet,
+        '.json': pandas.read_json, '.feather': pandas.read_feather, '.arrow': pandas.read_feather,
+        '.xlsx': pandas.read_excel, '.xls': pandas.read_excel,
+    }
+    if ext not in readers:
+        raise ValueError(f"Unknown data file format '{ext}' of {path}")
+    return readers[ext](path, **options)
+
+
+def load(path:str, directory:str=None, **options):
+    """Return the data of given file: a pandas DataFrame, or a numpy array for npy files.
+    Parsed tables are kept in given directory, if any.
+    Options are given to the pandas function reading the file"""
+    stat = os.stat(path)
+    path_key = os.path.abspath(path), repr(sorted(options.items()))
+    mtime, size, value = _loaded.get(path_key, (None, None, None))
+    if (mtime, size) != (stat.st_mtime_ns, stat.st_size):  # replaces the previous version, if any
+        key = hash_parts(*path_key[:1], str(stat.st_mtime_ns), str(stat.st_size), path_key[1])
+        value = _load_table(path, key, directory, options)
+        _loaded[path_key] = stat.st_mtime_ns, stat.st_size, value
+    return value.copy(deep=False) if hasattr(value, 'columns') else value
+
+
+def _load_table(path:str, key:str, directory:str, options:dict):
+    "Return the data of given file, from the Arrow cache if possible"
+    cached = os.path.join(directory, f'{key}.arrow') if directory else None
+    if cached and os.path.exists(cached):
+        try:
+            import pyarrow
+            with pyarrow.memory_map(cached) as source:
+                # one block per column, so columns that can be are views of the mapped file
+                return pyarrow.ipc.open_file(source).read_all().to_pandas(split_blocks=True)
+        except Exception as err:  # pyarrow not installed, or corrupted file
+            logger.debug(f"Cached table of {path} could not be read: {err}")
+    value = _read(path, **options)
+    if cached and hasattr(value, 'columns'):
+        try:
+            _write_table(value, cached)
+        except Exception as err:  # pyarrow not installed, or unsupported column types
+            logger.debug(f"Table of {path} could not be cached: {err}")
+    return value
+
+
+def _write_table(frame, path:str):
+    import pyarrow
+    import tempfile
+    table = pyarrow.Table.from_pandas(frame)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with tempfile.NamedTemporaryFile('wb', dir=os.path.dirname(path), delete=False) as fd:
+        with pyarrow.ipc.new_file(fd, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(fd.name, path)
@@ -0,0 +1,182 @@
+"""Names read from and written into the global environment by python codes.
+
+Blocks sharing the global environment depend on the blocks that last wrote
+the names they read. This module finds these names by analysis of the code syntax tree:
+
+    reads -- names loaded by the code before it binds them itself,
+             including names given as string to globals().get or globals()[...],
+             targets of augmented assignments (x += 1) and deleted names
+    writes -- names bound at module level, or declared global in functions
+
+The analysis is conservative on reads: global names loaded in functions are considered read
+when the function is defined. Values of read names may also be modified in place
+(data.append(2), data[0] = 1, f(data)), which syntax cannot tell: callers consider
+every name read by a global-env code as possibly written too.
+
+Functions defined by a code read global names when called, possibly from another code:
+analyze_functions gives these names for each function (or class, or alias of one),
+so callers consider them read, and possibly written, by the codes loading the function.
+Names accessed without syntax, e.g. through exec or globals().update, are not detected.
+
+"""
+
+import ast
+import sys
+import builtins
+import functools
+
+
+BUILTINS = frozenset(dir(builtins))
+
+
+class NamesVisitor(ast.NodeVisitor):
+    """Collect names loaded and bound in the scope of visited nodes.
+
+    Nested scopes (functions, classes, lambdas, comprehensions) are visited
+    by their own visitor: the names they load without binding them are loaded
+    by the enclosing scope, and the names they declare global are written in the module.
+
+    """
+
+    def __init__(self):
+        self.loaded, self.bound = set(), set()
+        self.declared = set()  # names declared global
+        self.written = set()  # module names written from nested scopes or through globals()
+
+    def visit_Name(self, node):
+        if isinstance(node.ctx, ast.Load):
+            self.loaded.add(node.id)
+        else:
+            self.bound.add(node.id)
+            if isinstance(node.ctx, ast.Del):  # deleting needs the name to exist
+                self.loaded.add(node.id)
+
+    def visit_AugAssign(self, node):
+        if isinstance(node.target, ast.Name):  # x += 1 reads x before binding it
+            self.loaded.add(node.target.id)
+        self.generic_visit(node)
+
+    def visit_Global(self, node):
+        self.declared.update(node.names)
+
+    def visit_alias(self, node):
+        self.bound.add((node.asname or node.name).split('.')[0])
+
+    def _visit_nested(self, nodes:list, bound:[str]=()):
+        "Visit given nodes in a nested scope, binding given names"
+        inner = NamesVisitor()
+        inner.bound.update(bound)
+        for node in nodes:
+            inner.visit(node)
+        self.loaded |= inner.loaded - (inner.bound - inner.declared)
+        self.written |= inner.written | (inner.bound & inner.declared)
+
+    def visit_FunctionDef(self, node):
+        self.bound.add(node.name)
+        args = node.args
+        for child in (*node.decorator_list, *args.defaults, *filter(None, args.kw_defaults)):
+            self.visit(child)
+        params = (*getattr(args, 'posonlyargs', ()), *args.args, args.vararg, *args.kwonlyargs, args.kwarg)
+        self._visit_nested(node.body, (param.arg for param in params if param))
+
+    visit_AsyncFunctionDef = visit_FunctionDef
+
+    def visit_Lambda(self, node):
+        args = node.args
+        for child in (*args.defaults, *filter(None, args.kw_defaults)):
+            self.visit(child)
+        params = (*getattr(args, 'posonlyargs', ()), *args.args, args.vararg, *args.kwonlyargs, args.kwarg)
+        self._visit_nested([node.body], (param.arg for param in params if param))
+
+    def visit_ClassDef(self, node):
+        self.bound.add(node.name)
+        for child in (*node.decorator_list, *node.bases, *node.keywords):
+            self.visit(child)
+        self._visit_nested(node.body)
+
+    def _visit_comprehension(self, node):
+        elements = [node.key, node.value] if isinstance(node, ast.DictComp) else [node.elt]
+        self._visit_nested([*node.generators, *elements])
+
+    visit_ListComp = visit_SetComp = visit_DictComp = visit_GeneratorExp = _visit_comprehension
+
+    def visit_Call(self, node):
+        # globals().get('name', default)
+        func = node.func
+        if (isinstance(func, ast.Attribute) and func.attr == 'get' and _is_globals_call(func.value)
+                and node.args and isinstance(node.args[0], ast.Constant) and isinstance(node.args[0].value, str)):
+            self.loaded.add(node.args[0].value)
+        self.generic_visit(node)
+
+    def visit_Subscript(self, node):
+        # globals()['name']
+        index = node.slice if sys.version_info >= (3, 9) else node.slice.value  # ast.Index before 3.9
+        if (_is_globals_call(node.value) and isinstance(index, ast.Constant) and isinstance(index.value, str)):
+            if isinstance(node.ctx, ast.Load):
+                self.loaded.add(index.value)
+            else:
+                self.written.add(index.value)
+        self.generic_visit(node)
+
+
+def _is_globals_call(node) -> bool:
+    return isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id == 'globals'
+
+
+@functools.lru_cache(maxsize=4096)
+def analyze(source:str) -> (frozenset, frozenset):
+    """Return names read and written by given source.
+    If it is invalid, nothing is read or written, as running it will fail"""
+    try:
+        tree = ast.parse(source)
+    except SyntaxError:
+        return frozenset(), frozenset()
+    reads, writes = set(), set()
+    for statement in tree.body:  # a name bound by a statement is not read by the next ones
+        visitor = NamesVisitor()
+        visitor.visit(statement)
+        reads |= visitor.loaded - writes
+        writes |= visitor.bound | visitor.written
+    return frozenset(reads - BUILTINS), frozenset(writes)
+
+
+@functools.lru_cache(maxsize=4096)
+def analyze_functions(source:str) -> {str: frozenset}:
+    """Return the global names read by the functions and classes defined at module level
+    by given source, keyed by function name. Names bound to a lambda or to another name
+    are included, reading the names loaded by their value.
+    The returned mapping must not be modified"""
+    try:
+        tree = ast.parse(source)
+    except SyntaxError:
+        return {}
+    functions = {}
+    for statement in tree.body:
+        if isinstance(statement, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            names, node = [statement.name], statement
+        elif isinstance(statement, ast.Assign) and isinstance(statement.value, (ast.Lambda, ast.Name)):
+            names, node = [target.id for target in statement.targets if isinstance(target, ast.Name)], statement.value
+        else:
+            continue
+        visitor = NamesVisitor()
+        visitor.visit(node)
+        functions.update(dict.fromkeys(names, frozenset(visitor.loaded - BUILTINS)))
+    return functions
+
+
+def analyze_stages(stages:[tuple]) -> (frozenset, frozenset):
+    "Return names read and written by given stages (see genhtml.compiling) run in order"
+    reads, writes = set(), set()
+    for source, *_ in stages:
+        stage_reads, stage_writes = analyze(source)
+        reads |= stage_reads - writes
+        writes |= stage_writes
+    return frozenset(reads), frozenset(writes)
+
+
+def analyze_stages_functions(stages:[tuple]) -> {str: frozenset}:
+    "Return the global names read by the functions defined by given stages, see analyze_functions"
+    functions = {}
+    for source, *_ in stages:
+        functions.update(analyze_functions(source))
+    return functions
@@ -0,0 +1,104 @@
+"""Copy-on-read namespaces, isolating python codes from the global environment.
+
+Instead of copying the whole global environment before running an isolated code,
+an IsolatedEnv copies only the values the code accesses, when it first accesses them.
+Immutable values, modules, functions and classes are never copied,
+and values that cannot be copied are shared.
+
+Values written by a code in the global environment can also be saved with snapshot,
+and restored later without running the code again.
+
+"""
+
+import copy
+import types
+
+
+IMMUTABLE_TYPES = (
+    type(None), bool, int, float, complex, str, bytes, range, frozenset, type,
+    types.ModuleType, types.FunctionType, types.BuiltinFunctionType, types.MethodType,
+)
+
+
+def is_immutable(value:object) -> bool:
+    "True if given value cannot be modified, and therefore does not need to be copied"
+    if isinstance(value, tuple):
+        return all(map(is_immutable, value))
+    return isinstance(value, IMMUTABLE_TYPES)
+
+
+class IsolatedEnv(dict):
+    """Namespace layered over a parent one, that is never modified.
+
+    Names missing from the namespace are looked up in the parent,
+    and their value copied in the namespace before being returned.
+
+    copied -- names whose value was deep-copied from the parent
+    shared -- names whose value could not be copied, and is shared with the parent
+
+    Note that iterating over the namespace (e.g. globals().items())
+    only yields the names accessed or defined by the code.
+
+    """
+
+    def __init__(self, parent:dict):
+        super().__init__()
+        self.parent = parent
+        self.copied, self.shared = set(), set()
+        self._deleted = set()  # names of parent deleted by the code
+
+    def __missing__(self, name:str):
+        if name in self._deleted or name not in self.parent:
+            raise KeyError(name)
+        value = self.parent[name]
+        if not is_immutable(value):
+            try:
+                value = copy.deepcopy(value)
+            except Exception:
+                self.shared.add(name)
+            else:
+                self.copied.add(name)
+        self[name] = value
+        return value
+
+    def __contains__(self, name:str) -> bool:
+        return dict.__contains__(self, name) or (name in self.parent and name not in self._deleted)
+
+    def __delitem__(self, name:str):
+        if not dict.__contains__(self, name):
+            self[name]  # raise KeyError if name is unknown
+        dict.__delitem__(self, name)
+        self._deleted.add(name)
+
+    def __setitem__(self, name:str, value:object):
+        self._deleted.discard(name)
+        dict.__setitem__(self, name, value)
+
+    def get(self, name:str, default:object=None) -> object:
+        try:
+            return self[name]
+        except KeyError:
+            return default
+
+
+def snapshot(env:dict, names:[str], mutated:[str]=()) -> bytes:
+    """Return the pickled values of given names in env, and of given mutated names
+    unless their value is immutable, as it then cannot have changed.
+    Values that cannot be pickled are listed as missing"""
+    import pickle  # not imported with genhtml, as it is slow to import
+    values, missing = {}, set()
+    for name in {*names, *mutated}:
+        if name not in env or (name not in names and is_immutable(env[name])):
+            continue
+        try:
+            values[name] = pickle.dumps(env[name])
+        except Exception:
+            missing.add(name)
+    return pickle.dumps((values, missing))
+
+
+def restore(data:bytes) -> (dict, set):
+    "Return values saved by snapshot, and the names that could not be saved"
+    import pickle
+    values, missing = pickle.loads(data)
+    return {name: pickle.loads(value) for name, value in values.items()}, missing
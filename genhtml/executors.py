@@ -0,0 +1,180 @@
+"""Executors running the python codes of blocks, and keeping the global environment.
+
+    in-process -- codes run in the markdown process (default)
+    subprocess -- codes run in a child process started from scratch (spawn)
+    forkserver -- codes run in a child process forked from a server process
+
+Out-of-process executors keep the global environment in the child,
+so a block leaking memory or crashing the interpreter does not affect the build:
+a dead child is replaced, and the global environment starts again empty.
+Only the HTML output crosses the process boundary. It is written by the child
+in a file of shared memory (/dev/shm when available), and decoded by the parent
+straight from the mapped file, instead of being pickled through the pipe.
+
+Executors implement run, reset, snapshot and update; see InProcessExecutor.
+
+"""
+
+import os
+import logging
+import tempfile
+import traceback
+import textwrap
+from .environment import IsolatedEnv, snapshot, restore
+
+
+logger = logging.getLogger(__name__)
+SHM_DIR = '/dev/shm' if os.path.isdir('/dev/shm') else None  # shared memory, or the default temp directory
+
+
+def run_in_env(global_env:dict, python_code:str or [tuple], format:str, use_global_env:bool, isolate_env:bool,
+               alt:str, title:str, images:dict=None, stats:dict=None, profile:bool=False,
+               limits:dict=None, cache_dir:str=None) -> (str, bool):
+    """Run given code (see genhtml.run_python) in the environment given by options,
+    updating global_env unless isolate_env is true"""
+    from .genhtml import run_python
+    env = global_env if use_global_env else {}
+    if isolate_env:
+        env = IsolatedEnv(env)
+    ret, success = run_python(python_code, env, format, alt, title, images, stats, profile, limits, cache_dir)
+    if isolate_env and (env.copied or env.shared):
+        logger.debug(f"Isolated code copied {', '.join(sorted(env.copied)) or 'nothing'}"
+                     f" and shared {', '.join(sorted(env.shared)) or 'nothing'} from the global environment")
+    if not isolate_env:
+        global_env.update(env)
+    return ret, success
+
+
+class InProcessExecutor:
+    "Run codes in the current process, keeping processed images and parsed data in given cache directory"
+
+    def __init__(self, cache_dir:str=None):
+        self.cache_dir = cache_dir
+        self.global_env = {}
+
+    def run(self, python_code:str or [tuple], format:str, use_global_env:bool, isolate_env:bool,
+            alt:str, title:str, images:dict=None, stats:dict=None, profile:bool=False,
+            limits:dict=None) -> (str, bool):
+        "Return the output of given code, and whether it succeeded"
+        return run_in_env(self.global_env, python_code, format, use_global_env, isolate_env,
+                          alt, title, images, stats, profile, limits, self.cache_dir)
+
+    def reset(self):
+        "Empty the global environment, e.g. before a new document"
+        self.global_env = {}
+
+    def snapshot(self, names:[str], mutated:[str]=()) -> bytes:
+        "Return given values of the global environment, see genhtml.environment.snapshot"
+        return snapshot(self.global_env, names, mutated)
+
+    def update(self, values:dict):
+        "Set given values in the global environment"
+        self.global_env.update(values)
+
+    def shutdown(self):
+        pass
+
+
+def _serve(conn, cache_dir:str, output_path:str):
+    "Run requests of the parent until it stops, in the child process"
+    executor = InProcessExecutor(cache_dir)
+    while True:
+        try:
+            command, *args = conn.recv()
+        except EOFError:  # parent is gone
+            return
+        if command == 'run':
+            stats = {}
+            ret, success = executor.run(*args[:7], stats, *args[7:])  # stats are sent back separately
+            data = ret.encode()
+            with open(output_path, 'wb') as fd:
+                fd.write(data)
+            conn.send((len(data), success, stats))
+        elif command == 'reset':
+            executor.reset()
+        elif command == 'snapshot':
+            conn.send(executor.snapshot(*args))
+        elif command == 'update':
+            executor.update(restore(args[0])[0])
+        elif command == 'stop':
+            return
+
+
+class ProcessExecutor:
+    """Run codes in a long-lived child process, started with given multiprocessing method.
+    The child is replaced if it dies"""
+
+    def __init__(self, cache_dir:str=None, method:str='spawn'):
+        import multiprocessing  # not imported with genhtml, as it is slow to import
+        self.cache_dir = cache_dir
+        self.context = multiprocessing.get_context(method)
+        self.process = self.conn = None
+        fd, self.output_path = tempfile.mkstemp(prefix='genhtml-', dir=SHM_DIR)
+        os.close(fd)
+
+    def _request(self, *message) -> object:
+        if self.process is None or not self.process.is_alive():
+            self._start()
+        self.conn.send(message)
+        return self.conn.recv() if message[0] in {'run', 'snapshot'} else None
+
+    def _start(self):
+        if self.process is not None:
+            logger.warning(f"Executor process died with exit code {self.process.exitcode}, and was replaced."
+                           " The global environment is lost")
+        self.conn, child_conn = self.context.Pipe()
+        self.process = self.context.Process(target=_serve, args=(child_conn, self.cache_dir, self.output_path),
+                                            daemon=True)
+        self.process.start()
+        child_conn.close()
+
+    def run(self, python_code:str or [tuple], format:str, use_global_env:bool, isolate_env:bool,
+            alt:str, title:str, images:dict=None, stats:dict=None, profile:bool=False,
+            limits:dict=None) -> (str, bool):
+        try:
+            size, success, child_stats = self._request('run', python_code, format, use_global_env, isolate_env,
+                                                       alt, title, images, profile, limits)
+        except (EOFError, OSError) as err:  # the child died while running the code
+            self.process.join()
+            err = ChildProcessError(f"Executor process died with exit code {self.process.exitcode}")
+            tb = ''.join(traceback.format_exception_only(type(err), err))
+            logger.warning(f"{type(err).__name__} raised by python code. Will be printed in output:\n{tb}")
+            return textwrap.indent(tb, ' '*4), False
+        if stats is not None:
+            stats.update(child_stats)
+        if not size:
+            return '', success
+        import mmap
+        with open(self.output_path, 'rb') as fd, mmap.mmap(fd.fileno(), size, access=mmap.ACCESS_READ) as data:
+            return str(data, 'utf-8'), success
+
+    def reset(self):
+        if self.process is not None and self.process.is_alive():
+            self._request('reset')
+
+    def snapshot(self, names:[str], mutated:[str]=()) -> bytes:
+        return self._request('snapshot', names, mutated)
+
+    def update(self, values:dict):
+        self._request('update', snapshot(values, values))
+
+    def shutdown(self):
+        if self.process is not None and self.process.is_alive():
+            self.conn.send(('stop',))
+            self.process.join()
+        self.process = None
+        if os.path.exists(self.output_path):
+            os.remove(self.output_path)
+
+    def __del__(self):
+        try:
+            self.shutdown()
+        except Exception:
+            pass
+
+
+EXECUTORS = {
+    'in-process': InProcessExecutor,
+    'subprocess': lambda cache_dir=None: ProcessExecutor(cache_dir, 'spawn'),
+    'forkserver': lambda cache_dir=None: ProcessExecutor(cache_dir, 'forkserver'),
+}
@@ -2,7 +2,6 @@
 #  render the image, or gif if `isgif` is thruthy.
 import os
 import io
-import base64
 import biseau
 import tempfile
 
@@ -29,4 +28,4 @@ elif config:
     pipeline = biseau.core.build_pipeline.from_json(config)
     databytes = build(pipeline)
 
-print(base64.b64encode(databytes).decode())
+emit_bytes(databytes, 'gif' if isgif else 'png')
@@ -1,17 +1,6 @@
-# Use pyplot and dot to render `graph` in png
-# Assume graph is a networkx Graph.
+# Use graphviz to render `graph` in png
+# Assume graph is a networkx Graph, a pydot graph or a dot source.
+# Graphs of a document are rendered at once, and cached, see genhtml.graphviz.
 
-# get the dot
-import io
-import base64
-from networkx.drawing.nx_pydot import write_dot
-with io.StringIO() as output:
-    write_dot(graph, output)
-    dot = output.getvalue()
-
-# get the png in base64
-import subprocess
-proc = subprocess.Popen(['dot', '-Tpng'], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
-stdout, _ = proc.communicate(dot.encode())
-import base64
-print(base64.b64encode(stdout).decode())
+import genhtml.graphviz
+print(genhtml.graphviz.placeholder(graph, 'png'))
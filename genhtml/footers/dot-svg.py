@@ -0,0 +1,6 @@
+# Use graphviz to render `graph` as inline svg, without base64 encoding
+# Assume graph is a networkx Graph, a pydot graph or a dot source.
+# Graphs of a document are rendered at once, and cached, see genhtml.graphviz.
+
+import genhtml.graphviz
+print(genhtml.graphviz.placeholder(graph, 'inline-svg'))
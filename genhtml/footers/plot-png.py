@@ -1,4 +1,3 @@
-import base64
 import plotly.io as pio
 
 # get arguments, if they exists
@@ -18,4 +17,4 @@ img_bytes = pio.to_image(
     **kwargs
 )
 
-print(base64.b64encode(img_bytes.getvalue()).decode())
+emit_bytes(img_bytes, 'png')
@@ -1,3 +1,5 @@
 # use plotly to build a figure and show the ready-to-include HTML
+# plotly.js is included once per document, see genhtml.charts and the plotly_js option
+from genhtml.charts import plot_div
 figure = go.Figure(data=[data], layout=layout)
-print(offline.plot(figure, output_type='div'))
+print(plot_div(figure))
@@ -22,19 +22,75 @@
         footer -- footer to use. You can combine with comma
         interpret -- if set to false, will show the code instead of its results
         global-env -- if set to true, the python code will use the global environment.
-        isolate-env -- if set to true, the python code will not modify the global environment
-        format -- define how to understand the code output. Default is html.
+        isolate-env -- if set to true, the python code will not modify the global environment.
+                       Values of the global environment are copied when first accessed.
+        format -- define how to understand the code output. Default is html, or markdown for genmark blocks.
         alt -- when producing images (see format), define the alt text
         title -- when producing images (see format), define the title text
+        width -- when producing images (see format), define the width attribute
+        height -- when producing images (see format), define the height attribute
+        max-width -- when producing images, downscale them to this width at most
+        quality -- when producing images, recompress them with this quality (1 to 100)
+        srcset -- when producing images, widths (comma separated) of smaller variants
+                  given to browsers in the srcset attribute
+        cache -- if set to false, the output will never be read from or written to the cache
+        cache-deps -- glob patterns (comma separated) of files read by the code,
+                      so the cached output is invalidated when they change
+        pure -- if set to true, the code is assumed to always give the same output,
+                which is reused by identical blocks of all documents of the build
+        timeout -- seconds after which the code is stopped. Default is given by block_timeout option.
+        memory -- megabytes the code can allocate. Default is given by block_memory option.
+                  With a timeout or memory limit, the code runs in a child process.
 
     The global environment is, at the beginning of the parsing, empty.
     It will be updated by all python codes. As a consequence, you can use
     the global environment to use data computed by scripts before the one you write.
 
     The format parameter is by default html.
-    Other possible values are png and svg. Note that the python code should not just
-    print raw png/svg data, but must first encode it in base64
+    Other possible values are png, gif, jpg, svg, webp and avif.
+    Note that the python code should not just print raw png/svg data, but must first encode it in base64
     with the standard module of the same name.
+    Alternatively, the code can give raw bytes to emit_bytes(data, format),
+    which will be rendered as an image without being printed.
+
+    Outputs of blocks with the markdown format are converted on their own, after their nested
+    blocks are expanded, by a markdown instance with the extensions of the fragment_extensions option
+    (markdown.extensions.extra by default), reused for all of them.
+    The resulting HTML is kept aside (htmlStash), so the document processors do not parse it again.
+    Outputs of nested blocks are converted with the output of their parent.
+
+    Data files read by many blocks can be loaded with data.load(path),
+    parsing each file only once (see genhtml.data). Like print, data is a builtin,
+    so functions defined by a block can use it when called by later blocks.
+
+    Blocks that neither read the global environment nor write in it while another
+    block reads it can be run in parallel by a pool of processes, see the workers option.
+    Workers execute headers once, and run each block in a copy of the resulting namespace.
+    Other blocks are run by the executor option, in the markdown process or in a child
+    process keeping the global environment (see genhtml.executors).
+
+    Images are converted to webp or avif with the corresponding format, whatever format
+    the code produces, and processed according to max-width, quality and srcset options.
+    Processed images are kept in the cache directory (see genhtml.imaging).
+
+    Images can be written as files in the directory given by assets_dir option
+    instead of being inlined, and will then be linked using assets_url.
+
+    Headers, block code and footers are compiled once, and executed one after the other.
+    Tracebacks therefore give lines relative to the block code, header or footer.
+
+    Outputs can be kept across builds in a directory given by the cache_dir option,
+    bounded in size by cache_max_bytes. Compiled headers and footers are also kept there.
+    Blocks using the global environment are cached too: their cache key includes the keys
+    of the blocks that last wrote the names they read (see genhtml.dependencies),
+    so editing a block only runs again the blocks depending on it.
+    Values written in the global environment are cached with the output,
+    and restored when a block is not run.
+
+    Measures of each block (see genhtml.profiling) are available after conversion
+    in the genhtml_stats attribute of the markdown instance, and can be written as JSON
+    in the file given by profile_report option. With the profile option,
+    peak memory and cProfile stats are also recorded.
 
     Installation
     ------------
@@ -47,43 +103,276 @@
 import os
 import io
 import re
-import copy
 import glob
 import base64
+import time
 import logging
 import textwrap
 import traceback
-import contextlib
-import pkg_resources
+import builtins
+import weakref
+import functools
+import collections
 import markdown
 from functools import partial
-from markdown.util import etree, AtomicString
-
-
-FALSY_VALUES = {'0', 'no', 'false', 'f'}
+from html import escape as html_escape
+from markdown.util import etree, AtomicString, STX, ETX
+from .cache import BlockCache, hash_parts, dependencies_fingerprint, subdirectory
+from .workers import WarmPool
+from .capture import capture_stdout
+from . import graphviz, imaging
+from . import data as data_loader
+from .compiling import compile_stage, headfoot_stage, block_stage
+from .environment import IsolatedEnv, snapshot, restore
+from .executors import InProcessExecutor, EXECUTORS
+from .limits import run_limited
+from .profiling import new_stats, measured, summary, write_report
+from .assets import AssetOutput, img_tag, asset_url, write_asset
+from .charts import include_library, first_chart, PLOTLY_JS_MODES
+from .blocks import BlockSpec, ARG_RE, FALSY_VALUES
+
+
+LIBDIR = os.path.dirname(os.path.abspath(__file__))  # contains default headers and footers
+MEMO_SIZE = 256  # number of outputs of pure blocks kept for reuse
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
 
-def raw_to_b64image(raw:str, alt:str='', title:str='', format:str='png') -> str:
+def raw_to_b64image(raw:str, alt:str='', title:str='', format:str='png', **attrs) -> str:
     "Return given raw data (understood as base64-encoded png) as an HTML-ready png image"
-    data = f'data:image/{format};base64,{raw.strip()}'
-    alt = f' alt="{alt}"' if alt else ''
-    title = f' title="{title}"' if title else ''
-    return f'<img src="{data}"{alt}{title} />'
-def raw_to_raw(raw:str, alt:str='', title:str='', format:str='png') -> str:
+    return img_tag(f'data:image/{format};base64,{raw.strip()}', alt, title, **attrs)
+def raw_to_raw(raw:str, alt:str='', title:str='', format:str='png', **attrs) -> str:
     "Return raw as-is, whatever the other arguments are. Mocking behavior of raw_to_* functions"
     return raw
 
+IMAGE_TYPES = {  # format -> image subtype
+    'png': 'png', 'gif': 'gif', 'jpg': 'jpg', 'svg': 'svg+xml', 'webp': 'webp', 'avif': 'avif',
+}
 DATA_FORMATS = {
-    'png': partial(raw_to_b64image, format='png'),
-    'gif': partial(raw_to_b64image, format='gif'),
-    'jpg': partial(raw_to_b64image, format='jpg'),
-    'svg': partial(raw_to_b64image, format='svg+xml'),
+    **{format: partial(raw_to_b64image, format=subtype) for format, subtype in IMAGE_TYPES.items()},
     'html': raw_to_raw,
     'markdown': raw_to_raw,
 }
 
+
+class BinaryOutput:
+    """Receive raw bytes written by python code with emit_bytes(data, format),
+    and base64-encode them as they come, to render them as a single image.
+
+    Only the encoded chunks are kept, and they are joined once with the img tag,
+    so the raw data is never copied whole.
+
+    """
+    CHUNK_SIZE = 3 * 2**16  # multiple of 3, so chunks are encoded without padding
+
+    def __init__(self):
+        self.chunks = []
+        self.format = None
+        self._rest = b''  # up to 2 bytes waiting for the next write to be encoded
+
+    def __bool__(self):
+        return bool(self.chunks or self._rest)
+
+    def emit_bytes(self, data:bytes, format:str=None):
+        "Add given bytes to the image, with given format (png, gif, jpg or svg)"
+        if format:
+            self.format = format.lower()
+        view = memoryview(data).cast('B')
+        if self._rest:  # complete the triplet left by previous write
+            missing = 3 - len(self._rest)
+            self._rest += view[:missing].tobytes()
+            view = view[missing:]
+            if len(self._rest) < 3:
+                return
+            self.chunks.append(base64.b64encode(self._rest).decode('ascii'))
+        end = len(view) - len(view) % 3
+        for start in range(0, end, self.CHUNK_SIZE):
+            chunk = view[start:min(start + self.CHUNK_SIZE, end)]
+            self.chunks.append(base64.b64encode(chunk).decode('ascii'))
+        self._rest = view[end:].tobytes()
+
+    def to_html(self, alt:str='', title:str='', format:str='png', **attrs) -> str:
+        "Return the img tag showing received data"
+        if self._rest:
+            self.chunks.append(base64.b64encode(self._rest).decode('ascii'))
+            self._rest = b''
+        subtype = IMAGE_TYPES.get(self.format or format, 'png')
+        # the tag is built around a placeholder, so the data is copied only once, by the join
+        before, after = img_tag('\0', alt, title, **attrs).split('\0')
+        return ''.join((f'{before}data:image/{subtype};base64,', *self.chunks, after))
+
+    def getvalue(self) -> bytes:
+        "Return received data, and forget it"
+        data = base64.b64decode(''.join(self.chunks)) + self._rest
+        self.discard()
+        return data
+
+    def discard(self):
+        "Forget received data"
+        self.chunks, self._rest = [], b''
+
+
+def render_output(raw:str, format:str, alt:str='', title:str='', images:dict=None, cache_dir:str=None) -> str:
+    """Return given printed output converted according to format.
+
+    images -- rendering options of images: width, height, lazy (for lazy loading),
+              and assets_dir and assets_url to write images as files instead of inlining them.
+    cache_dir -- cache directory of the extension, where processed images are kept
+
+    """
+    images = images or {}
+    attrs = image_attributes(images)
+    if format in IMAGE_TYPES and graphviz.PLACEHOLDER_RE.fullmatch(raw.strip()):  # rendered with the document
+        return raw.strip()
+    if format in IMAGE_TYPES and imaging.is_requested(format, images):
+        return render_image(base64.b64decode(raw), format, alt, title, images, cache_dir)
+    if format in IMAGE_TYPES and images.get('assets_dir'):
+        name = write_asset(base64.b64decode(raw), format, images['assets_dir'])
+        return img_tag(asset_url(name, images.get('assets_url', '')), alt, title, **attrs)
+    return DATA_FORMATS[format](raw, alt, title, **attrs)
+
+
+def image_attributes(images:dict) -> dict:
+    "Return the additional attributes of img tags for given rendering options"
+    return {
+        'width': images.get('width', ''),
+        'height': images.get('height', ''),
+        'loading': 'lazy' if images.get('lazy') else '',
+    }
+
+
+def render_image(data:bytes, format:str, alt:str='', title:str='', images:dict=None, cache_dir:str=None) -> str:
+    """Return the img tag of given image, processed according to images options
+    max_width, quality and srcset (see genhtml.imaging)"""
+    images = images or {}
+    variants = imaging.process(data, format, images.get('max_width'), images.get('quality'), images.get('srcset', ()),
+                               subdirectory(cache_dir, 'images'))
+    sources = [(image_source(data, format, images), width) for data, format, width in variants]
+    attrs = image_attributes(images)
+    if len(sources) > 1:
+        attrs['srcset'] = ', '.join(f'{src} {width}w' for src, width in sources)
+    return img_tag(sources[0][0], alt, title, **attrs)
+
+
+def image_source(data:bytes, format:str, images:dict) -> str:
+    "Return the URL of given image: its file in assets directory if any, else a data URI"
+    if images.get('assets_dir'):
+        return asset_url(write_asset(data, format, images['assets_dir']), images.get('assets_url', ''))
+    return f"data:image/{IMAGE_TYPES.get(format, 'png')};base64,{base64.b64encode(data).decode('ascii')}"
+
+
+@functools.lru_cache(maxsize=None)
+def code_builtins(cache_dir:str=None) -> dict:
+    "Return the builtins of python codes: those of python, and data keeping parsed tables in given cache directory"
+    return {**vars(builtins), 'data': data_loader.Loader(subdirectory(cache_dir, 'data'))}
+
+
+def run_python(python_code:str or [tuple], env:dict, format:str, alt:str, title:str,
+               images:dict=None, stats:dict=None, profile:bool=False, limits:dict=None,
+               cache_dir:str=None) -> (str, bool):
+    """Execute given code in given environment, and return its output converted
+    according to format, and whether it ran successfully.
+    On exception, the output is the indented traceback.
+
+    The code is either a source, or stages (see genhtml.compiling),
+    compiled only once and executed one after the other.
+
+    The code can call emit_bytes(data, format) to output an image without printing it,
+    in which case the printed output is ignored.
+    See render_output for images options.
+    If given, stats is updated with execution measures (see genhtml.profiling),
+    including peak memory and cProfile stats if profile is true.
+    If limits gives a timeout (seconds) or memory (megabytes), the code runs
+    in a child process, see run_python_limited.
+    Processed images and parsed data are kept in given cache directory, if any.
+
+    This is a module-level function so it can be sent to worker processes.
+
+    """
+    if limits and (limits.get('timeout') or limits.get('memory')):
+        return run_python_limited(python_code, env, format, alt, title, images, stats, profile, limits, cache_dir)
+    images = images or {}
+    fd = io.StringIO()
+    if images.get('assets_dir'):
+        binary = AssetOutput(images['assets_dir'], images.get('assets_url', ''))
+    else:
+        binary = BinaryOutput()
+    env['emit_bytes'] = binary.emit_bytes
+    env['__builtins__'] = code_builtins(cache_dir)
+    stats = {} if stats is None else stats
+    with capture_stdout(fd), measured(stats, profile):
+        try:
+            if isinstance(python_code, str):
+                codes = [python_code]
+            else:  # compile all stages first, so none runs if one is invalid
+                codes = [compile_stage(*stage) for stage in python_code if stage[0]]
+            for code in codes:
+                # see https://docs.python.org/3/library/functions.html#exec for params duplication
+                exec(code, env, env)
+        except Exception as err:
+            tb = traceback.format_exc()
+            logger.warning(f"{type(err).__name__} raised by python code. Will be printed in output:\n{tb}")
+            binary.discard()
+            return textwrap.indent(tb, ' '*4), False
+        finally:
+            if env.get('emit_bytes') == binary.emit_bytes:  # do not leak it in the global environment
+                del env['emit_bytes']
+    try:
+        if binary and imaging.is_requested(format, images):
+            target = format if format in IMAGE_TYPES else binary.format or 'png'
+            return render_image(binary.getvalue(), target, alt, title, images, cache_dir), True
+        if binary:
+            return binary.to_html(alt, title, format, **image_attributes(images)), True
+        return render_output(fd.getvalue(), format, alt, title, images, cache_dir), True
+    except Exception as err:  # e.g. printed output is not base64, or not a readable image
+        tb = traceback.format_exc()
+        logger.warning(f"{type(err).__name__} raised by output rendering. Will be printed in output:\n{tb}")
+        return textwrap.indent(tb, ' '*4), False
+
+
+def run_python_limited(python_code:str or [tuple], env:dict, format:str, alt:str, title:str,
+                       images:dict=None, stats:dict=None, profile:bool=False, limits:dict=None,
+                       cache_dir:str=None) -> (str, bool):
+    """Like run_python, but in a child process stopped after limits['timeout'] seconds,
+    and that cannot allocate more than limits['memory'] megabytes (see genhtml.limits).
+
+    Values the code binds in env, and those it reads as they may be modified,
+    are sent back to update env. Values that cannot be pickled are lost.
+    Going over the time limit gives an output like an exception.
+
+    """
+    stats = {} if stats is None else stats
+
+    def run_in_child():
+        before, child_stats = dict(env), {}
+        ret, success = run_python(python_code, env, format, alt, title, images, child_stats, profile,
+                                  cache_dir=cache_dir)
+        names = set()
+        if not isinstance(env, IsolatedEnv):  # changes of isolated environments are dropped anyway
+            from .dependencies import analyze, analyze_stages  # not imported with genhtml, as ast is slow to import
+            reads, _ = analyze(python_code) if isinstance(python_code, str) else analyze_stages(python_code)
+            names = {name for name in env if name in reads or name not in before or before[name] is not env[name]}
+        return ret, success, child_stats, snapshot(env, names), before.keys() - env.keys()
+
+    start = time.perf_counter()
+    try:
+        ret, success, child_stats, values, deleted = run_limited(
+            run_in_child, limits.get('timeout') or 0, limits.get('memory') or 0)
+    except Exception as err:
+        stats['exec_time'] = time.perf_counter() - start
+        tb = ''.join(traceback.format_exception_only(type(err), err))
+        logger.warning(f"{type(err).__name__} raised by python code. Will be printed in output:\n{tb}")
+        return textwrap.indent(tb, ' '*4), False
+    stats.update(child_stats)
+    values, missing = restore(values)
+    if missing:
+        logger.debug(f"Values of {', '.join(sorted(missing))} could not be sent back from the child process")
+    env.update(values)
+    for name in deleted:
+        env.pop(name, None)
+    return ret, success
+
+
 def gen_headfoots_from_dir(directory:str) -> [(str, str)]:
     """Yield pairs (name, lines) of headers/footers found in given directory"""
 
@@ -107,84 +396,380 @@ def gen_headfoots_from_dir(directory:str) -> [(str, str)]:
 class GenHTMLPreprocessor(markdown.preprocessors.Preprocessor):
     # Regular expression inspired from fenced_code
     BLOCK_RE = re.compile(r'''
-        ^```gen(html|mark) (?P<args>[=\w'" +,_-]*)\s*\n
+        ^```gen(html|mark) (?P<args>[=\w'" +,_*./-]*)\s*\n
         (?P<code>.*?)(?<=\n)
         ^``` *$
         ''', re.MULTILINE | re.DOTALL | re.VERBOSE)
 
+    ARG_RE = ARG_RE
+
     def __init__(self, md):
         super().__init__(md)
+        self.cache = None
+        self.cache_dir = None  # where outputs, compiled codes, graphs, images and data are kept
+        self.pool = None
+        self.executor = InProcessExecutor()  # runs blocks not sent to the pool, keeps the global environment
+        self.profile = False
+        self.plotly_js, self.plotly_lazy = 'inline-once', False
+        self.fragment_md = None  # markdown instance converting outputs of the markdown format
+        self.stashed = {}
+        self.stats = []
+        self.memo = collections.OrderedDict()  # memo key -> output of pure blocks, across documents
+        self.reused = 0  # number of pure blocks not run, across documents
+        self._finalizer = None  # stops the executor process and the workers, see close
+
+    def close(self):
+        """Stop the executor process and the workers started by this markdown instance.
+        Also done when it is garbage collected, or when the interpreter exits"""
+        if self._finalizer:
+            self._finalizer()
 
     def run(self, lines):
-        self.__global_env = {}
+        self.executor.reset()
+        self.stashed = {}  # placeholder without its markers -> placeholder, see StashedFragmentsPreprocessor
+        self.__writers = {}  # name -> (cache key, line) of the block that last wrote it
+        self.__functions = {}  # name of a function in the global environment -> global names it reads
+        self.__pending = {}  # memo key -> future of the pure block submitted to the pool
+        self.__graph_blocks = []  # rendering options of blocks printing graph placeholders
+        self.stats = self.markdown.genhtml_stats = []
         text = '\n'.join(lines)
-        did_replace = True
-        while did_replace:
-            text, did_replace = self._replace_block(text)
-
+        specs = self.index(text)
+        # blocks generated by outputs (nested generation) are not indexed yet, and may read the environment
+        self.__global_env_is_read = any(spec.global_env or self._may_generate_blocks(spec) for spec in specs)
+        text = self._expand(text, specs=specs)
+        if self.__graph_blocks:
+            text = self._render_graphs(text)
+        text = self._include_library(text)
+        if self.stats:
+            profiling_enabled = self.profile or self.config.get('profile_report')
+            logger.log(logging.INFO if profiling_enabled else logging.DEBUG, summary(self.stats))
+        if self.config.get('profile_report'):
+            write_report(self.stats, self.config['profile_report'])
         return text.split('\n')
 
-    def _replace_block(self, text):
-        # Parse block
-        m = self.BLOCK_RE.search(text)
-        if not m:
-            return text, False
-
-        # Parse arguments
-        ARG_RE = re.compile(r'''(?P<field>[\w-]+)=(?P<quote>"|'|)(?P<value>[a-zA-Z0-9,+_-]+)(?P=quote)''')
-        header, footer, interpret, dataformat, alt, title = '', '', True, 'html', '', ''
-        use_global_env, isolate_env = False, False
-        for key, _, value in ARG_RE.findall(m.group('args')):
-            if key == 'header':
-                header = value.strip().strip('"\'')
-            elif key == 'footer':
-                footer = value.strip().strip('"\'')
-            elif key == 'interpret':
-                interpret = value.lower() not in FALSY_VALUES
-            elif key == 'format':
-                dataformat = value.lower()
-                if dataformat not in DATA_FORMATS:
-                    logger.warning(f"Unrecognized format '{dataformat}'. 'html' will be used instead")
-                    dataformat = 'html'
-            elif key == 'alt':
-                alt = value.strip('\'"')
-            elif key == 'title':
-                title = value.strip('\'"')
-            elif key in {'global-env', 'global'}:
-                use_global_env = value.lower() not in FALSY_VALUES
-            elif key in {'isolate-env', 'isolated-env', 'isolated'}:
-                isolate_env = value.lower() not in FALSY_VALUES
-            else:
-                logger.warning(f"Unrecognized option '{key}' with value '{value}'")
-
-        raw_code = self.generate_python_code(m.group('code'), header.split(','), footer.split(','))
-        if interpret:
-            raw_html = self.generate_html(raw_code, dataformat, use_global_env, isolate_env, alt, title)
-            return text[:m.start()] + raw_html + text[m.end():], True
-        else:  # just show python code
-            return text[:m.start()] + textwrap.indent(raw_code, ' '*4) + text[m.end():], True
-
-
-    def generate_html(self, python_code:str, format:str, use_global_env:bool,
-                      isolate_env:bool, alt:str, title:str) -> str:
-        fd = io.StringIO()
-        env = self.__global_env if use_global_env else {}
-        if isolate_env:
-            env = copy.deepcopy(env)
-        with contextlib.redirect_stdout(fd):
+    def _expand(self, text:str, line:int=None, specs:[BlockSpec]=None) -> str:
+        """Return given text with all blocks replaced by their output.
+
+        Text is scanned once, from start to end. Outputs that contain blocks themselves
+        (nested generation) are expanded on their own before the scan goes on,
+        so blocks are still executed in document order.
+        Blocks independent of the global environment may run in the worker pool meanwhile.
+
+        line -- line of the parent block, when expanding a generated text
+        specs -- blocks of the text, if already indexed
+
+        """
+        blocks = [self._parse_block(spec) for spec in (self.index(text, line) if specs is None else specs)]
+        if self.pool:
+            for block in blocks:
+                self._submit_block(block)
+        future_reads, reads = [], frozenset()  # names read in the global environment after each block
+        for block in reversed(blocks):
+            future_reads.append(reads)
+            if block['global_env']:
+                reads |= block['reads']
+        segments, last = [], 0
+        for block, later_reads in zip(blocks, reversed(future_reads)):
+            segments.append(text[last:block['start']])
+            fragment = self._render_block(block, later_reads)
+            if self.BLOCK_RE.search(fragment):
+                self._check_generated_blocks(fragment, block['stats']['line'])
+                fragment = self._expand(fragment, block['stats']['line'])
+            if block['format'] == 'markdown' and line is None:  # nested outputs are converted with their parent
+                fragment = self._stash_markdown(fragment)
+            segments.append(fragment)
+            last = block['end']
+        segments.append(text[last:])
+        return ''.join(segments)
+
+    def _include_library(self, text:str) -> str:
+        """Return given text with plotly.js inserted before its first chart,
+        which may be in the outputs of the markdown format"""
+        options = self.plotly_js, self.plotly_lazy, self.config.get('assets_dir', ''), self.config.get('assets_url', '')
+        stash = self.markdown.htmlStash
+        first, index = first_chart(text), None
+        for idx, (html, _) in enumerate(stash.rawHtmlBlocks):
+            position = text.find(stash.get_placeholder(idx)) if first_chart(html) >= 0 else -1
+            if position >= 0 and (first < 0 or position < first):
+                first, index = position, idx
+        if index is None:
+            return include_library(text, *options)
+        html, safe = stash.rawHtmlBlocks[index]
+        stash.rawHtmlBlocks[index] = include_library(html, *options), safe
+        return text
+
+    def _render_graphs(self, text:str) -> str:
+        """Return given text with graph placeholders replaced by their images,
+        also in the outputs of the markdown format, all graphs being rendered at once"""
+        stash = self.markdown.htmlStash.rawHtmlBlocks
+        indexes = [idx for idx, (html, _) in enumerate(stash) if '<!--genhtml-graph ' in html]
+        images = graphviz.render_placeholders([text, *(stash[idx][0] for idx in indexes)],
+                                              subdirectory(self.cache_dir, 'graphviz'))
+
+        def replace(match) -> str:
             try:
-                # see https://docs.python.org/3/library/functions.html#exec for params duplication
-                exec(python_code, env, env)
-            except Exception as err:
-                tb = traceback.format_exc()
-                logger.warning(f"{type(err).__name__} raised by python code. Will be printed in output:\n{tb}")
-                ret = textwrap.indent(tb, ' '*4)
-            else:
-                ret = DATA_FORMATS[format](fd.getvalue(), alt, title)
-        if not isolate_env:
-            self.__global_env.update(env)
+                return self._graph_html(match, images[match.group()])
+            except Exception as err:  # invalid graph, or image
+                logger.warning(f"{type(err).__name__} raised by graph rendering. Will be printed in output:\n{err}")
+                return f'<pre><code>{type(err).__name__}: {html_escape(str(err))}</code></pre>'
+
+        for idx in indexes:
+            stash[idx] = graphviz.PLACEHOLDER_RE.sub(replace, stash[idx][0]), stash[idx][1]
+        return graphviz.PLACEHOLDER_RE.sub(replace, text)
+
+    def _graph_html(self, match, image:bytes or Exception) -> str:
+        "Return the HTML of given image, replacing given placeholder"
+        if isinstance(image, Exception):
+            raise image
+        if match['format'] == 'inline-svg':
+            svg = image.decode()
+            return svg[svg.find('<svg'):]  # drop the xml declaration and doctype
+        format, alt, title, images = self.__graph_blocks[int(match['block'] or 0)]
+        if imaging.is_requested(format, images):
+            target = format if format in IMAGE_TYPES else match['format']
+            return render_image(image, target, alt, title, images, self.cache_dir)
+        return img_tag(image_source(image, match['format'], images), alt, title, **image_attributes(images))
+
+    def _may_generate_blocks(self, spec:BlockSpec) -> bool:
+        "True if given block may print blocks, as its code, headers or footers contain a fence"
+        sources = (spec.code, *(self.header.get(header, '') for header in spec.headers),
+                   *(self.footer.get(footer, '') for footer in spec.footers))
+        return spec.interpret and any('```' in source for source in sources)
+
+    def _check_generated_blocks(self, fragment:str, line:int):
+        "Warn if blocks generated at given line read the global environment, while it was thought unread"
+        if not self.__global_env_is_read and any(spec.global_env for spec in self.index(fragment, line)):
+            logger.warning(f"Blocks generated by block at line {line} use the global environment, but it was not"
+                           " kept for them: values written by blocks run in workers or read from the cache"
+                           " are missing. Write the fence of generated blocks literally (```)")
+
+    def index(self, text:str, line:int=None) -> [BlockSpec]:
+        """Return the blocks found in given text, without running them.
+        Blocks in outputs of other blocks (nested generation) are not included.
+
+        line -- line of all blocks, when indexing a generated text
+
+        """
+        specs, pos, block_line = [], 0, 1
+        for m in self.BLOCK_RE.finditer(text):
+            block_line += text.count('\n', pos, m.start())
+            pos = m.start()
+            spec = BlockSpec(m.start(), m.end(), block_line if line is None else line,
+                             m.group('args'), m.group('code'), 'markdown' if m.group(1) == 'mark' else 'html')
+            if spec.format not in DATA_FORMATS:
+                logger.warning(f"Unrecognized format '{spec.format}'. 'html' will be used instead")
+                spec.format = 'html'
+            specs.append(spec)
+        return specs
+
+    def _stash_markdown(self, fragment:str) -> str:
+        "Return the placeholder of the HTML converted from given markdown, inserted back by the document"
+        if self.fragment_md is None:
+            self.fragment_md = self._fragment_markdown()
+        html = self.fragment_md.reset().convert(fragment)
+        if not html:
+            return ''
+        placeholder = self.markdown.htmlStash.store(html, safe=True)
+        self.stashed[placeholder.strip(STX + ETX)] = placeholder
+        return '\n\n' + placeholder + '\n\n'
+
+    def _fragment_markdown(self) -> markdown.Markdown:
+        "Return a markdown instance with the extensions of the fragment_extensions option"
+        options = {'safe_mode': self.markdown.safeMode} if self.markdown.safeMode else {}
+        extensions = [name.strip() for name in self.config.get('fragment_extensions', '').split(',') if name.strip()]
+        return markdown.Markdown(extensions=extensions, output_format=self.markdown.output_format, **options)
+
+    def _parse_block(self, spec:BlockSpec) -> dict:
+        "Return the python code and rendering state of given block"
+        start_time = time.perf_counter()
+        limits = {
+            'timeout': self.config.get('block_timeout') or 0 if spec.timeout is None else spec.timeout,
+            'memory': self.config.get('block_memory') or 0 if spec.memory is None else spec.memory,
+        }
+        raw_code = self.generate_python_code(spec.code, spec.headers, spec.footers)
+        images = {
+            'assets_dir': self.config.get('assets_dir', ''), 'assets_url': self.config.get('assets_url', ''),
+            'lazy': str(self.config.get('assets_lazy', '')).lower() not in FALSY_VALUES | {''},
+            'width': spec.width, 'height': spec.height,
+            'max_width': spec.max_width, 'quality': spec.quality, 'srcset': spec.srcset,
+        }
+        stages = self.generate_stages(spec.code, spec.headers, spec.footers, spec.line)
+        cache_key, reads, writes, mutated, functions = None, frozenset(), frozenset(), frozenset(), {}
+        if spec.interpret and self.cache:
+            # not imported with genhtml, as ast is slow to import
+            from .dependencies import analyze_stages, analyze_stages_functions
+            reads, writes = analyze_stages(stages)
+            if spec.global_env:
+                functions = analyze_stages_functions(stages)
+            if spec.global_env and not spec.isolate_env:  # values read may be modified in place
+                mutated = reads
+            if spec.cache:  # completed at rendering with the writers of reads, if global_env
+                deps = dependencies_fingerprint(spec.cache_deps)
+                cache_key = hash_parts(raw_code, spec.format, spec.alt, spec.title,
+                                       *map(str, images.values()), *deps)
+        memo_key = None
+        if spec.pure and spec.interpret and self._is_env_independent(spec.global_env, spec.isolate_env):
+            memo_key = hash_parts(raw_code, spec.format, spec.alt, spec.title, *map(str, images.values()))
+        elif spec.pure:
+            logger.debug(f"Block at line {spec.line} uses the global environment, and will not be reused")
+        stats = new_stats(spec.line, spec.headers, spec.footers)
+        stats['parse_time'] = time.perf_counter() - start_time
+        return {
+            'start': spec.start, 'end': spec.end, 'code': raw_code, 'interpret': spec.interpret,
+            'headers': spec.headers, 'stages': stages, 'format': spec.format, 'alt': spec.alt, 'title': spec.title,
+            'global_env': spec.global_env, 'isolate_env': spec.isolate_env, 'images': images,
+            'cache_key': cache_key, 'memo_key': memo_key, 'reads': reads, 'writes': writes,
+            'mutated': mutated, 'functions': functions, 'limits': limits, 'future': None, 'stats': stats,
+        }
+
+    def _submit_block(self, block:dict):
+        "Start running given block in the worker pool, if it does not need the global environment"
+        if not block['interpret'] or not self._is_env_independent(block['global_env'], block['isolate_env']):
+            return
+        if block['memo_key'] in self.memo:
+            return  # will be reused
+        if block['memo_key'] in self.__pending:  # identical to a block already submitted
+            block['future'] = self.__pending[block['memo_key']]
+            return
+        if block['cache_key'] and self.cache.get(block['cache_key']) is not None:  # key is complete
+            return  # will be read from cache
+        block['future'] = self.pool.submit(block['headers'], block['stages'][len(block['headers']):],
+                                           block['format'], block['alt'], block['title'], block['images'],
+                                           self.profile, block['limits'])
+        if block['memo_key']:
+            self.__pending[block['memo_key']] = block['future']
+
+    def _render_block(self, block:dict, later_reads:frozenset=frozenset()) -> str:
+        """Return the text replacing given block.
+        later_reads -- names read in the global environment by the next blocks"""
+        ret, reusable = self._render_block_output(block, later_reads)
+        if '<!--genhtml-graph ' in ret:  # placeholders are rendered with the options of the block
+            self.__graph_blocks.append((block['format'], block['alt'], block['title'], block['images']))
+            block_id = len(self.__graph_blocks) - 1
+            ret = graphviz.PLACEHOLDER_RE.sub(
+                lambda match: match.group() if match['block'] else f'{match.group()[:-3]} {block_id}-->', ret)
+        if self.cache and block['interpret'] and not block['isolate_env']:
+            # blocks reading what this one wrote can be reused only if this one can
+            key = block['cache_key'] if reusable else os.urandom(16).hex()
+            for name in block['writes'] | block['mutated']:
+                self.__writers[name] = key, block['stats']['line']
+            if block['global_env']:
+                for name in block['writes']:
+                    self.__functions.pop(name, None)
+                self.__functions.update(block['functions'])
+        block['stats']['output_size'] = len(ret)
+        self.stats.append(block['stats'])
         return ret
 
+    def _render_block_output(self, block:dict, later_reads:frozenset) -> (str, bool):
+        """Return the output of given block, and whether it was cached or can be"""
+        if not block['interpret']:  # just show python code
+            return textwrap.indent(block['code'], ' '*4), False
+        if block['memo_key'] in self.memo:
+            self.memo.move_to_end(block['memo_key'])
+            block['stats']['reused'] = True
+            self.reused += 1
+            return self.memo[block['memo_key']], bool(block['cache_key'])
+        if block['cache_key'] and block['global_env']:
+            self._add_function_reads(block)
+            block['cache_key'] = self._dependent_key(block)
+        if block['cache_key']:
+            cached = self._read_cache(block, later_reads)
+            if cached is not None:
+                block['stats']['cached'] = True
+                self._memoize(block, cached)
+                return cached, True
+        if block['future'] is None:
+            ret, success = self._run_block_code(block['stages'], block['format'], block['global_env'],
+                                                block['isolate_env'], block['alt'], block['title'],
+                                                block['images'], block['stats'], block['limits'])
+        else:
+            try:
+                ret, success, stats = block['future'].result()
+            except Exception as err:  # the worker itself failed, e.g. killed
+                tb = ''.join(traceback.format_exception(type(err), err, err.__traceback__))
+                logger.warning(f"{type(err).__name__} raised by worker. Will be printed in output:\n{tb}")
+                ret, success, stats = textwrap.indent(tb, ' '*4), False, {}
+            block['stats'].update(stats)
+        if success:  # failures are not cached, as they may be transient
+            self._memoize(block, ret)
+        if success and block['cache_key']:
+            self.cache.set(block['cache_key'], ret)
+            if self._saves_env(block):
+                self.cache.set(block['cache_key'] + '.env', self.executor.snapshot(block['writes'], block['mutated']))
+        return ret, success and bool(block['cache_key'])
+
+    def _memoize(self, block:dict, output:str):
+        "Keep given output of given block for identical blocks, if it is pure"
+        if block['memo_key']:
+            self.memo[block['memo_key']] = output
+            self.__pending.pop(block['memo_key'], None)
+            while len(self.memo) > MEMO_SIZE:
+                self.memo.popitem(last=False)
+
+    def _add_function_reads(self, block:dict):
+        """Add to the names read by given block the global names read by the functions it loads,
+        and by the functions these read, as it may call them. Unless the block is isolated,
+        these names are also possibly written, as functions may modify them in place"""
+        reads, todo = set(block['reads']), list(block['reads'])
+        while todo:
+            for name in self.__functions.get(todo.pop(), ()):
+                if name not in reads:
+                    reads.add(name)
+                    todo.append(name)
+        if not block['isolate_env']:
+            block['mutated'] |= reads - block['reads']
+        block['reads'] = frozenset(reads)
+
+    def _dependent_key(self, block:dict) -> str:
+        "Return the cache key of given block, including the keys of the writers of names it reads"
+        writers = sorted((name, *self.__writers[name]) for name in block['reads'] if name in self.__writers)
+        block['stats']['depends_on'] = sorted({line for _, _, line in writers})
+        return hash_parts(block['cache_key'], *(f'{name}={key}' for name, key, _ in writers))
+
+    def _saves_env(self, block:dict) -> bool:
+        "True if values written by given block in the global environment must be cached with its output"
+        return not block['isolate_env'] and bool(block['writes'] | block['mutated']) and self.__global_env_is_read
+
+    def _read_cache(self, block:dict, later_reads:frozenset) -> str or None:
+        """Return the cached output of given block, restoring the values it writes
+        in the global environment, or None if it has to be run"""
+        cached = self.cache.get(block['cache_key'])
+        if cached is None or not self._saves_env(block):
+            return cached
+        data = self.cache.get(block['cache_key'] + '.env', binary=True)
+        if data is None:
+            return None
+        try:
+            values, missing = restore(data)
+        except Exception as err:  # e.g. class of a value no longer exists
+            logger.debug(f"Values of block at line {block['stats']['line']} could not be restored: {err}")
+            return None
+        if missing & later_reads:  # values that could not be cached are needed
+            return None
+        self.executor.update(values)
+        return cached
+
+    def _is_env_independent(self, use_global_env:bool, isolate_env:bool) -> bool:
+        """True if a block with given options neither depends on the global environment,
+        nor modifies it while another block reads it"""
+        if use_global_env:
+            return False
+        return isolate_env or not self.__global_env_is_read
+
+
+    def generate_html(self, python_code:str or [tuple], format:str, use_global_env:bool,
+                      isolate_env:bool, alt:str, title:str) -> str:
+        "Return the output of given code, run by the executor without cache"
+        return self.executor.run(python_code, format, use_global_env, isolate_env, alt, title,
+                                 profile=self.profile)[0]
+
+    def _run_block_code(self, python_code:str or [tuple], format:str, use_global_env:bool,
+                        isolate_env:bool, alt:str, title:str, images:dict=None,
+                        stats:dict=None, limits:dict=None) -> (str, bool):
+        return self.executor.run(python_code, format, use_global_env, isolate_env, alt, title,
+                                 images, stats, self.profile, limits)
+
     def generate_python_code(self, python_code:str, headers:[str], footers:[str]) -> str:
         return '\n'.join((
             *(self.header.get(header, '') for header in headers),
@@ -192,11 +777,22 @@ class GenHTMLPreprocessor(markdown.preprocessors.Preprocessor):
             *(self.footer.get(footer, '') for footer in footers)
         ))
 
+    def generate_stages(self, python_code:str, headers:[str], footers:[str], line:int=None) -> [tuple]:
+        """Return the stages (see genhtml.compiling) of given code: one per header,
+        then the code itself, numbered from its first line and named after given line of the document,
+        then one per footer"""
+        code_dir = subdirectory(self.cache_dir, 'code')
+        return [
+            *(headfoot_stage('header', header, self.header.get(header, ''), code_dir) for header in headers),
+            block_stage(textwrap.dedent(python_code), line),
+            *(headfoot_stage('footer', footer, self.footer.get(footer, ''), code_dir) for footer in footers),
+        ]
+
 
     def build_configs(self):
         "Load default and custom headers/footers in memory"
-        header_libdir = pkg_resources.resource_filename('genhtml', 'headers/')
-        footer_libdir = pkg_resources.resource_filename('genhtml', 'footers/')
+        header_libdir = os.path.join(LIBDIR, 'headers')
+        footer_libdir = os.path.join(LIBDIR, 'footers')
         self.header = dict(gen_headfoots_from_dir(header_libdir))
         self.footer = dict(gen_headfoots_from_dir(footer_libdir))
         if self.config.get('headers_dir'):
@@ -209,6 +805,55 @@ class GenHTMLPreprocessor(markdown.preprocessors.Preprocessor):
         self.footer[''] = self.footer['default']
         self.header['none'] = ''
         self.footer['none'] = ''
+        self.profile = str(self.config.get('profile', '')).lower() not in FALSY_VALUES | {''}
+        self.plotly_js = self.config.get('plotly_js') or 'inline-once'
+        if self.plotly_js not in PLOTLY_JS_MODES:
+            logger.warning(f"Unrecognized plotly_js '{self.plotly_js}'. 'inline-once' will be used instead")
+            self.plotly_js = 'inline-once'
+        self.plotly_lazy = str(self.config.get('plotly_lazy', '')).lower() not in FALSY_VALUES | {''}
+        self.cache_dir = self.config.get('cache_dir') or None
+        if self.cache_dir:
+            self.cache = BlockCache(self.cache_dir, self.config.get('cache_max_bytes'))
+        executor = self.config.get('executor') or 'in-process'
+        if isinstance(executor, str) and executor not in EXECUTORS:
+            logger.warning(f"Unrecognized executor '{executor}'. 'in-process' will be used instead")
+            executor = 'in-process'
+        if isinstance(executor, str):
+            self.executor = EXECUTORS[executor](self.cache_dir)
+        else:  # an executor object, see genhtml.executors
+            self.executor = executor
+        if int(self.config.get('workers') or 0) > 1:
+            self.pool = WarmPool(
+                self.config['workers'], self.header, self.cache_dir,
+                preload=filter(None, self.config.get('worker_preload', '').split(',')),
+                max_blocks=self.config.get('worker_max_blocks'),
+                max_memory=self.config.get('worker_max_memory'),
+            )
+        # executor objects given in config are left to their owner
+        owned = [self.executor] if isinstance(executor, str) else []
+        self._finalizer = weakref.finalize(self, shutdown_all, owned + [self.pool] if self.pool else owned)
+
+
+def shutdown_all(runners:list):
+    "Shut down given executors and pools"
+    for runner in runners:
+        try:
+            runner.shutdown()
+        except Exception as err:
+            logger.warning(f"{type(runner).__name__} could not be shut down: {err}")
+
+
+class StashedFragmentsPreprocessor(markdown.preprocessors.Preprocessor):
+    """Restore the markers of placeholders inserted by the genhtml preprocessor,
+    removed by the normalize_whitespace preprocessor running after it"""
+
+    def __init__(self, md, genhtml:GenHTMLPreprocessor):
+        super().__init__(md)
+        self.genhtml = genhtml
+
+    def run(self, lines):
+        stashed = self.genhtml.stashed
+        return [stashed.get(line, line) for line in lines] if stashed else lines
 
 
 # For details see https://pythonhosted.org/Markdown/extensions/api.html#extendmarkdown
@@ -218,6 +863,29 @@ class GenHTMLMarkdownExtension(markdown.Extension):
         self.config = {
             'headers_dir': ['', "Directory containing custom python headers."],
             'footers_dir': ['', "Directory containing custom python footers."],
+            'cache_dir': ['', "Directory where block outputs are kept across builds. Disabled if empty."],
+            'cache_max_bytes': [0, "Maximal size of the cache directory. No limit if 0."],
+            'assets_dir': ['', "Directory where images are written, instead of being inlined. Disabled if empty."],
+            'assets_url': ['', "URL of assets_dir in the generated pages, prefixing image file names."],
+            'assets_lazy': [False, "If true, images are loaded lazily by browsers."],
+            'profile': [False, "If true, peak memory and cProfile stats of each block are recorded."],
+            'profile_report': ['', "JSON file where stats of each block are written. Disabled if empty."],
+            'workers': [0, "Number of processes running blocks independent of the global environment."
+                           " Blocks are run in the markdown process if lower than 2."],
+            'worker_preload': ['default', "Headers (comma separated) executed by workers when they start."],
+            'worker_max_blocks': [0, "Number of blocks run by a worker before it is replaced. No limit if 0."],
+            'worker_max_memory': [0, "Memory, in megabytes, used by a worker before it is replaced. No limit if 0."],
+            'block_timeout': [0, "Seconds after which a block is stopped, unless it sets timeout. No limit if 0."],
+            'block_memory': [0, "Megabytes a block can allocate, unless it sets memory. No limit if 0."],
+            'plotly_js': ['inline-once', "How charts of the plot footer load plotly.js, once per document:"
+                                         " inline-once, cdn, file (in assets_dir) or none (loaded by the page)."],
+            'plotly_lazy': [False, "If true, charts of the plot footer are drawn when scrolled into view."],
+            'fragment_extensions': ['markdown.extensions.extra', "Markdown extensions (comma separated)"
+                                    " converting outputs of the markdown format (markdown does not tell"
+                                    " the extensions of the document). None if empty."],
+            'executor': ['in-process', "Where blocks keeping the global environment are run:"
+                                       " in-process, subprocess or forkserver (in a child process surviving"
+                                       " crashes), or an executor object (see genhtml.executors)."],
         }
         super().__init__(*args, **kwargs)
 
@@ -226,6 +894,8 @@ class GenHTMLMarkdownExtension(markdown.Extension):
         blockprocessor.config = self.getConfigs()
         blockprocessor.build_configs()
         md.preprocessors.add('genhtml', blockprocessor, '_begin')
+        md.preprocessors.add('genhtml_fragments', StashedFragmentsPreprocessor(md, blockprocessor),
+                             '>normalize_whitespace')
 
 
 def makeExtension(*args, **kwargs):
@@ -0,0 +1,139 @@
+"""Rendering of graphviz sources into images, shared by the graph footers.
+
+    svg = render(graph, 'svg')
+    pngs = render_many([graph1, graph2], 'png')
+    print(placeholder(graph, 'png'))  # rendered with all graphs of the document
+
+Footers print placeholders instead of rendering graphs one by one:
+the genhtml preprocessor finds them in the outputs of the whole document,
+and renders all their graphs with a single call of render_many per format.
+
+Graphs are dot sources, networkx graphs or objects with a to_string method (pydot, pygraphviz).
+Rendered images are kept in memory, and on disk in the directory given to the render functions,
+keyed by the hash of the dot source, layout program and format,
+so an unchanged graph is never rendered twice.
+If pygraphviz is installed, graphs are rendered in-process.
+Otherwise, graphviz is started once per call of render_many, whatever the number of graphs.
+
+"""
+
+import os
+import re
+import base64
+import logging
+import tempfile
+import collections
+from .cache import shared_cache, hash_parts
+
+
+logger = logging.getLogger(__name__)
+MEMORY_CACHE_SIZE = 256  # number of images kept in memory
+_memory = collections.OrderedDict()  # key -> image, from least to most recently used
+PLACEHOLDER_RE = re.compile(r'<!--genhtml-graph (?P<format>[\w-]+) (?P<program>[\w.-]+) (?P<source>[\w+/=]*)'
+                            r'(?: (?P<block>\d+))?-->')
+
+
+def to_dot(graph) -> str:
+    "Return the dot source of given graph"
+    if isinstance(graph, str):
+        return graph
+    if hasattr(graph, 'to_string'):  # pydot or pygraphviz graph
+        return graph.to_string()
+    from networkx.drawing.nx_pydot import to_pydot
+    return to_pydot(graph).to_string()
+
+
+def placeholder(graph, format:str='png', program:str='dot') -> str:
+    """Return the text standing for the image of given graph in the output of a block,
+    until the graphs of the document are rendered. Format inline-svg gives the svg markup"""
+    source = base64.b64encode(to_dot(graph).encode()).decode('ascii')
+    return f'<!--genhtml-graph {format} {program} {source}-->'
+
+
+def render_placeholders(texts:[str], directory:str=None) -> dict:
+    """Return the image of the graph of each placeholder found in given texts, keyed by placeholder match,
+    or the exception raised while rendering it, rendering all graphs at once per format and program.
+    Images are kept in given directory, if any"""
+    requests = collections.defaultdict(dict)  # (format, program) -> {match: source}
+    for text in texts:
+        for match in PLACEHOLDER_RE.finditer(text):
+            format, program = match['format'], match['program']
+            requests['svg' if format == 'inline-svg' else format, program][match.group()] = \
+                base64.b64decode(match['source']).decode()
+    images = {}
+    for (format, program), sources in requests.items():
+        try:
+            images.update(zip(sources, render_many(list(sources.values()), format, program, directory)))
+        except Exception:  # render separately, to fail on the invalid ones only
+            for match, source in sources.items():
+                try:
+                    images[match] = render(source, format, program, directory)
+                except Exception as err:
+                    images[match] = err
+    return images
+
+
+def render(graph, format:str='png', program:str='dot', directory:str=None) -> bytes:
+    "Return the image of given graph in given format, laid out by given graphviz program"
+    return render_many([graph], format, program, directory)[0]
+
+
+def render_many(graphs:list, format:str='png', program:str='dot', directory:str=None) -> [bytes]:
+    """Return the images of given graphs, rendering at once those not rendered yet,
+    neither in memory nor in given directory"""
+    sources = [to_dot(graph) for graph in graphs]
+    keys = [hash_parts(program, format, source) for source in sources]
+    images = {key: _cached(key, directory) for key in keys}
+    todo = {key: source for key, source in zip(keys, sources) if images[key] is None}
+    if todo:
+        for key, image in zip(todo, _run_graphviz(list(todo.values()), format, program)):
+            images[key] = image
+            _store(key, image, directory)
+    return [images[key] for key in keys]
+
+
+def _cached(key:str, directory:str=None) -> bytes or None:
+    if key in _memory:
+        _memory.move_to_end(key)
+        return _memory[key]
+    image = shared_cache(directory).get(key, binary=True) if directory else None
+    if image is not None:
+        _store(key, image)
+    return image
+
+
+def _store(key:str, image:bytes, directory:str=None):
+    _memory[key] = image
+    while len(_memory) > MEMORY_CACHE_SIZE:
+        _memory.popitem(last=False)
+    if directory:
+        shared_cache(directory).set(key, image)
+
+
+def _run_graphviz(sources:[str], format:str, program:str) -> [bytes]:
+    "Return images of given dot sources, in a single graphviz execution"
+    import subprocess  # only needed without pygraphviz, and slow to import
+    try:
+        import pygraphviz
+    except ImportError:
+        pass
+    else:
+        return [pygraphviz.AGraph(string=source).draw(format=format, prog=program) for source in sources]
+    with tempfile.TemporaryDirectory() as directory:
+        paths = []
+        for idx, source in enumerate(sources):
+            paths.append(os.path.join(directory, f'{idx}.gv'))
+            with open(paths[-1], 'w') as fd:
+                fd.write(source)
+        proc = subprocess.run([program, f'-T{format}', '-O', *paths], stdout=subprocess.PIPE,
+                              stderr=subprocess.PIPE, universal_newlines=True)
+        if proc.returncode and len(sources) > 1:  # render separately, to fail on the invalid one
+            logger.debug(f"{program} failed on {len(sources)} graphs, rendering them one by one")
+            return [image for source in sources for image in _run_graphviz([source], format, program)]
+        if proc.returncode:
+            raise RuntimeError(f"{program} failed to render the graph:\n{proc.stderr}")
+        images = []
+        for path in paths:
+            with open(f'{path}.{format}', 'rb') as fd:
+                images.append(fd.read())
+        return images
@@ -1,21 +1,23 @@
 # Default header, importing many recurrent packages
+# Heavy packages are imported on first use, so blocks not using them do not pay their import.
 import itertools
 import functools
 import collections
+from genhtml.lazy import lazy_import
 try:
-    import plotly.offline as offline
-    import plotly.graph_objs as go
+    offline = lazy_import('plotly.offline')
+    go = lazy_import('plotly.graph_objs')
 except ImportError:
     pass
 try:
-    import pandas as pd
+    pd = lazy_import('pandas')
 except ImportError:
     pass
 try:
-    import networkx as nx
+    nx = lazy_import('networkx')
 except ImportError:
     pass
 try:
-    import clyngor
+    clyngor = lazy_import('clyngor')
 except ImportError:
     pass
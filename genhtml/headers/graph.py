@@ -1,21 +1,22 @@
-# graph-related packages
+# graph-related packages, imported on first use
+from genhtml.lazy import lazy_import
 try:
-    import pydot
+    pydot = lazy_import('pydot')
 except ImportError:
     pass
 try:
-    import networkx as nx
+    nx = lazy_import('networkx')
 except ImportError:
     pass
 try:
-    import powergrasp
+    powergrasp = lazy_import('powergrasp')
 except ImportError:
     pass
 try:
-    import bubbletools
+    bubbletools = lazy_import('bubbletools')
 except ImportError:
     pass
 try:
-    import phasme
+    phasme = lazy_import('phasme')
 except ImportError:
     pass
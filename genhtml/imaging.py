@@ -0,0 +1,87 @@
+"""Post-processing of images produced by blocks, before they are inlined or written as assets.
+
+Images can be downscaled to a maximal width, recompressed with a given quality,
+converted to webp or avif, and rendered in smaller variants for the srcset attribute.
+Processed images are cached in memory and in the directory given to process,
+keyed by the hash of the input image and the processing options,
+so an image is processed only once.
+
+Needs Pillow. Animated images and svg are kept as they are.
+
+"""
+
+import io
+import logging
+import hashlib
+import collections
+from .cache import shared_cache, hash_parts
+
+
+logger = logging.getLogger(__name__)
+CONVERTED_FORMATS = {'webp', 'avif'}  # formats images are converted to, whatever their format
+PIL_FORMATS = {'png': 'PNG', 'jpg': 'JPEG', 'gif': 'GIF', 'webp': 'WEBP', 'avif': 'AVIF'}  # format -> pillow format
+DEFAULT_QUALITY = {'jpg': 85, 'webp': 80, 'avif': 60}
+MEMORY_CACHE_SIZE = 64  # number of processed images kept in memory
+_memory = collections.OrderedDict()  # key -> variants, from least to most recently used
+
+
+def is_requested(format:str, images:dict) -> bool:
+    "True if images produced with given block format and images options must be processed"
+    return bool(format in CONVERTED_FORMATS or images.get('max_width') or images.get('quality')
+                or images.get('srcset'))
+
+
+def process(data:bytes, format:str, max_width:int=0, quality:int=0, widths:[int]=(),
+            directory:str=None) -> [(bytes, str, int)]:
+    """Return the processed image and its smaller variants of given widths,
+    as (data, format, width) tuples, the processed image being first.
+    Processed images are kept in given directory, if any"""
+    key = hash_parts(hashlib.sha256(data).hexdigest(), format, str(max_width), str(quality), *map(str, widths))
+    if key in _memory:
+        _memory.move_to_end(key)
+        return _memory[key]
+    import pickle  # not imported with genhtml, as it is slow to import
+    disk = shared_cache(directory) if directory else None
+    cached = disk.get(key, binary=True) if disk else None
+    variants = pickle.loads(cached) if cached is not None else _process(data, format, max_width, quality, widths)
+    _memory[key] = variants
+    while len(_memory) > MEMORY_CACHE_SIZE:
+        _memory.popitem(last=False)
+    if disk and cached is None:
+        disk.set(key, pickle.dumps(variants))
+    return variants
+
+
+def _process(data:bytes, format:str, max_width:int, quality:int, widths:[int]) -> [(bytes, str, int)]:
+    from PIL import Image, features
+    if format not in PIL_FORMATS:
+        return [(data, format, None)]
+    image = Image.open(io.BytesIO(data))
+    if getattr(image, 'n_frames', 1) > 1:  # animations are not processed
+        return [(data, format, image.width)]
+    if format == 'avif' and not features.check('avif'):
+        logger.warning("This Pillow cannot write avif images. webp will be used instead")
+        format = 'webp'
+    if max_width and image.width > int(max_width):
+        image = _resized(image, int(max_width))
+    variants = [(_encode(image, format, quality), format, image.width)]
+    for width in sorted(set(map(int, widths)), reverse=True):
+        if width < image.width:
+            variants.append((_encode(_resized(image, width), format, quality), format, width))
+    return variants
+
+
+def _resized(image, width:int):
+    from PIL import Image
+    return image.resize((width, max(1, round(image.height * width / image.width))), Image.LANCZOS)
+
+
+def _encode(image, format:str, quality:int) -> bytes:
+    options = {'optimize': True} if format in {'png', 'jpg'} else {}
+    if format in DEFAULT_QUALITY:
+        options['quality'] = int(quality or DEFAULT_QUALITY[format])
+    if format == 'jpg' and image.mode not in {'RGB', 'L'}:
+        image = image.convert('RGB')
+    with io.BytesIO() as output:
+        image.save(output, format=PIL_FORMATS[format], **options)
+        return output.getvalue()
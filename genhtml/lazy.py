@@ -0,0 +1,34 @@
+"""Modules imported on first use, for headers providing many packages.
+
+    pd = lazy_import('pandas')
+
+binds pd to a module that imports pandas only when one of its attributes is accessed.
+Like a regular import, ImportError is raised immediately if the package is not installed.
+
+"""
+
+import sys
+import types
+import importlib
+import importlib.util
+
+
+class LazyModule(types.ModuleType):
+    "Module importing the real one on first attribute access"
+
+    def __getattr__(self, attr:str):
+        module = importlib.import_module(self.__name__)
+        self.__dict__.update(module.__dict__)  # next accesses do not go through __getattr__
+        return getattr(module, attr)
+
+    def __repr__(self):
+        return f"<lazy module '{self.__name__}'>"
+
+
+def lazy_import(name:str) -> types.ModuleType:
+    "Return the module of given name, imported on first use"
+    if name in sys.modules:
+        return sys.modules[name]
+    if importlib.util.find_spec(name.split('.')[0]) is None:
+        raise ImportError(f"No module named '{name}'", name=name)
+    return LazyModule(name)
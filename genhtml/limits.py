@@ -0,0 +1,83 @@
+"""Execution of functions in a supervised child process, with bounded time and memory.
+
+The child is forked, so it starts with the whole state of the parent,
+e.g. the global environment or the warm namespace of a worker,
+and sends back the result of the function through a pipe.
+It is killed when it runs longer than its timeout, and its address space
+is limited so that allocating more than its memory limit raises MemoryError.
+
+Needs os.fork, and therefore does not limit anything on Windows.
+
+"""
+
+import os
+import time
+import select
+import signal
+import logging
+import traceback
+
+
+logger = logging.getLogger(__name__)
+
+
+class LimitExceeded(Exception):
+    "Raised when the child process is killed, or dies"
+
+
+def used_memory() -> int:
+    "Return the size in bytes of the address space of the current process, or 0 if unknown"
+    try:
+        with open('/proc/self/statm') as fd:
+            return int(fd.read().split()[0]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def run_limited(function, timeout:float=0, memory:float=0) -> object:
+    """Return function() computed in a forked process, stopped after timeout seconds,
+    and that cannot allocate more than given megabytes. Zero means no limit.
+    The result must be picklable."""
+    if not hasattr(os, 'fork'):
+        logger.warning("Time and memory limits are not available on this platform")
+        return function()
+    import pickle  # not imported with genhtml, as it is slow to import
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:  # child
+        os.close(read_fd)
+        try:
+            if memory:
+                import resource
+                limit = used_memory() + int(memory * 2**20)
+                resource.setrlimit(resource.RLIMIT_AS, (limit, resource.getrlimit(resource.RLIMIT_AS)[1]))
+            data = pickle.dumps((True, function()))
+        except BaseException:
+            data = pickle.dumps((False, traceback.format_exc()))
+        with os.fdopen(write_fd, 'wb') as fd:
+            fd.write(data)
+        os._exit(0)
+    os.close(write_fd)
+    chunks, deadline = [], time.monotonic() + timeout if timeout else None
+    try:
+        while True:
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                os.kill(pid, signal.SIGKILL)
+                raise TimeoutError(f"Code did not complete within {timeout:g} seconds, and was stopped")
+            if select.select([read_fd], [], [], remaining)[0]:
+                chunk = os.read(read_fd, 1 << 16)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+    finally:
+        os.close(read_fd)
+        _, status = os.waitpid(pid, 0)
+    if not chunks:
+        if os.WIFSIGNALED(status):
+            raise LimitExceeded(f"Code was killed by signal {os.WTERMSIG(status)}")
+        raise LimitExceeded(f"Code process exited with status {os.WEXITSTATUS(status)}")
+    success, result = pickle.loads(b''.join(chunks))
+    if not success:
+        raise LimitExceeded(f"Code process failed:\n{result}")
+    return result
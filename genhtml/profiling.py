@@ -0,0 +1,81 @@
+"""Measures of blocks compilation, to find out which blocks make a build slow.
+
+Stats of a block are gathered in a dict with the following keys:
+
+    line -- line of the block in the document (or of its parent block for nested blocks)
+    headers, footers -- names of headers and footers used by the block
+    parse_time -- seconds spent parsing options and building the python code
+    exec_time -- seconds spent running the python code, or None if it did not run
+    output_size -- number of characters of the output
+    peak_memory -- bytes allocated at peak during execution, if profiling is enabled
+    cached -- true if the output was read from the cache
+    reused -- true if the output of an identical pure block was reused, instead of running the code
+    depends_on -- lines of the blocks that wrote global environment values read by the block
+    profile -- functions taking most time during execution, if profiling is enabled
+
+"""
+
+import io
+import time
+import contextlib
+
+
+def new_stats(line:int, headers:[str], footers:[str]) -> dict:
+    return {
+        'line': line, 'headers': list(headers), 'footers': list(footers),
+        'parse_time': 0., 'exec_time': None, 'output_size': 0,
+        'peak_memory': None, 'cached': False, 'reused': False, 'depends_on': [], 'profile': None,
+    }
+
+
+@contextlib.contextmanager
+def measured(stats:dict, profile:bool=False):
+    """Record in stats the time spent in the context,
+    and, if profile is true, its peak memory and main functions"""
+    if profile:  # profiling modules are only imported when needed, as they are slow to import
+        import pstats
+        import cProfile
+        import tracemalloc
+        tracing = tracemalloc.is_tracing()
+        if not tracing:
+            tracemalloc.start()
+        start_memory = tracemalloc.get_traced_memory()[0]
+        if hasattr(tracemalloc, 'reset_peak'):  # python 3.9+
+            tracemalloc.reset_peak()
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:  # another profiler is active
+            profiler = None
+    start = time.perf_counter()
+    try:
+        yield stats
+    finally:
+        stats['exec_time'] = time.perf_counter() - start
+        if profile:
+            stats['peak_memory'] = tracemalloc.get_traced_memory()[1] - start_memory
+            if not tracing:
+                tracemalloc.stop()
+        if profile and profiler:
+            profiler.disable()
+            with io.StringIO() as fd:
+                pstats.Stats(profiler, stream=fd).sort_stats('cumulative').print_stats(10)
+                stats['profile'] = fd.getvalue()
+
+
+def summary(stats:[dict], number:int=5) -> str:
+    "Return a one-line description of the slowest blocks"
+    slowest = sorted((block for block in stats if block['exec_time'] is not None),
+                     key=lambda block: block['exec_time'], reverse=True)[:number]
+    total = sum(block['exec_time'] or 0. for block in stats)
+    reused = sum(block['reused'] for block in stats)
+    return (f"{len(stats)} blocks ran in {total:.3f}s"
+            + (f", {reused} reused from identical pure blocks" if reused else '') + ". Slowest: "
+            + ', '.join(f"line {block['line']} ({block['exec_time']:.3f}s)" for block in slowest))
+
+
+def write_report(stats:[dict], path:str):
+    "Write given stats as JSON in given file"
+    import json
+    with open(path, 'w') as fd:
+        json.dump(stats, fd, indent=2)
@@ -0,0 +1,160 @@
+"""Pool of long-lived worker processes running blocks.
+
+Each worker executes the headers once, and keeps the resulting namespace.
+Blocks are then run in a shallow copy of that warm namespace,
+instead of executing again the imports and setup of their headers.
+Consequently, blocks share the objects created by headers,
+as modules are shared by all blocks of a single process.
+
+Workers are recycled after a given number of blocks,
+or when their memory usage grows too large.
+
+"""
+
+import io
+import logging
+import resource
+import traceback
+from .cache import subdirectory
+from .compiling import compile_stage, headfoot_stage
+from .capture import capture_stdout
+
+
+logger = logging.getLogger(__name__)
+_headers = {}  # header name -> header code, in workers
+_namespaces = {}  # tuple of header codes -> namespace resulting of their execution, in workers
+_printing = set()  # tuples of header codes printing something when executed, in workers
+_cache_dir = None  # cache directory of the pool of the worker, in workers
+
+
+def _init_worker(headers:dict, preload:[str], cache_dir:str=None):
+    "Record headers codes and cache directory, and execute headers to preload"
+    global _cache_dir
+    _headers.update(headers)
+    _cache_dir = cache_dir
+    for name in preload:
+        try:
+            warm_namespace((name,))
+        except Exception:
+            logger.warning(f"Header '{name}' could not be preloaded:\n{traceback.format_exc()}")
+
+
+def _namespace_key(header_names:tuple) -> tuple:
+    "Key of the namespace of given headers: their codes, as different names can give the same code"
+    return tuple(_headers.get(name, '') for name in header_names)
+
+
+def warm_namespace(header_names:tuple) -> dict:
+    """Return the namespace resulting of given headers execution, executing them only once.
+    What they print is not kept, see prints_output"""
+    key = _namespace_key(header_names)
+    if key not in _namespaces:
+        env, output = {}, io.StringIO()
+        with capture_stdout(output):
+            for name in header_names:
+                if _headers.get(name):
+                    stage = headfoot_stage('header', name, _headers[name], subdirectory(_cache_dir, 'code'))
+                    exec(compile_stage(*stage), env, env)
+        if output.getvalue():
+            _printing.add(key)
+        _namespaces[key] = env
+    return _namespaces[key]
+
+
+def prints_output(header_names:tuple) -> bool:
+    "True if given headers, executed by warm_namespace, printed something"
+    return _namespace_key(header_names) in _printing
+
+
+def run_block(header_names:tuple, stages:[tuple], format:str, alt:str, title:str,
+              images:dict=None, profile:bool=False, limits:dict=None) -> (str, bool, dict, int):
+    """Run given stages (block code and footers) in a copy of the warm namespace of its headers.
+
+    Return the output, whether the code succeeded, its stats (see genhtml.profiling)
+    and the peak memory usage of the worker in kilobytes.
+    If the headers themselves fail or print something, they are run again with the other stages,
+    so the output is exactly the one of a cold execution.
+
+    """
+    from .genhtml import run_python
+    stats = {}
+    try:
+        env = dict(warm_namespace(header_names))
+        if prints_output(header_names):
+            raise RuntimeError("headers output is part of the block output")
+    except Exception:
+        code_dir = subdirectory(_cache_dir, 'code')
+        header_stages = [headfoot_stage('header', name, _headers.get(name, ''), code_dir) for name in header_names]
+        ret, success = run_python(header_stages + list(stages), {}, format, alt, title,
+                                  images, stats, profile, limits, _cache_dir)
+    else:
+        ret, success = run_python(stages, env, format, alt, title, images, stats, profile, limits, _cache_dir)
+    return ret, success, stats, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class WarmPool:
+    """Process pool whose workers execute headers once.
+
+    workers -- number of worker processes
+    headers -- mapping from header name to header code
+    cache_dir -- cache directory of the extension, where workers keep compiled headers and footers,
+                 rendered graphs and processed images
+    preload -- names of headers to execute when workers start
+    max_blocks -- if non-zero, workers are replaced after running that many blocks each
+    max_memory -- if non-zero, workers are replaced once one of them
+                  used more than that many megabytes
+
+    """
+
+    def __init__(self, workers:int, headers:dict, cache_dir:str=None, preload:[str]=('default',),
+                 max_blocks:int=0, max_memory:int=0):
+        self.workers = int(workers)
+        self.headers = dict(headers)
+        self.cache_dir = cache_dir
+        self.preload = tuple(preload)
+        self.max_blocks = int(max_blocks or 0)
+        self.max_memory = int(max_memory or 0)
+        self._executor = None
+        self._submitted = 0  # number of blocks submitted to current executor
+        self._exhausted = False  # true when a worker went over max_memory
+
+    def _recycle(self):
+        "Replace current executor by a new one. Blocks already submitted will still complete"
+        import concurrent.futures  # not imported with genhtml, as it is slow to import
+        if self._executor:
+            logger.debug(f"Recycle workers after {self._submitted} blocks")
+            self._executor.shutdown(wait=False)
+        self._executor = concurrent.futures.ProcessPoolExecutor(
+            self.workers, initializer=_init_worker,
+            initargs=(self.headers, self.preload, self.cache_dir),
+        )
+        self._submitted, self._exhausted = 0, False
+
+    def submit(self, header_names:tuple, stages:[tuple], format:str, alt:str, title:str,
+               images:dict=None, profile:bool=False, limits:dict=None) -> 'concurrent.futures.Future':
+        "Return a future of the output of given block, whether it succeeded and its stats"
+        import concurrent.futures
+        if (self._executor is None or self._exhausted
+                or (self.max_blocks and self._submitted >= self.max_blocks * self.workers)):
+            self._recycle()
+        self._submitted += 1
+        future = concurrent.futures.Future()
+
+        def on_done(worker_future):
+            try:
+                ret, success, stats, memory = worker_future.result()
+            except Exception as err:
+                future.set_exception(err)
+                return
+            if self.max_memory and memory > self.max_memory * 1024:
+                self._exhausted = True
+            future.set_result((ret, success, stats))
+
+        self._executor.submit(run_block, tuple(header_names), stages,
+                              format, alt, title, images, profile, limits).add_done_callback(on_done)
+        return future
+
+    def shutdown(self, wait:bool=True):
+        if self._executor:
+            self._executor.shutdown(wait=wait)
+            self._executor = None
@@ -23,6 +23,9 @@
     Options are optional, but if present must be specified in the order format, alt.
     The option value may be enclosed in single or double quotes.
 
+    plotly.js is included once per document, before the first chart (see genhtml.charts
+    and the plotly_js option).
+
     Installation
     ------------
     You need to install [plotly][] (`pip install plotly` or alike).
@@ -84,6 +87,9 @@ class PlotPreprocessor(markdown.preprocessors.Preprocessor):
         while did_replace:
             text, did_replace = self._replace_block(text)
 
+        from genhtml.charts import include_library  # plotly.js, once before the first chart
+        text = include_library(text, self.config['plotly_js'], self.config['plotly_lazy'],
+                               self.config['assets_dir'], self.config['assets_url'])
         return text.split('\n')
 
     def _replace_block(self, text):
@@ -144,8 +150,8 @@ class PlotPreprocessor(markdown.preprocessors.Preprocessor):
     def build_configs(self):
         self.imports = textwrap.dedent(
         '''
-            import plotly.offline as offline
             import plotly.graph_objs as go
+            from genhtml.charts import plot_div
             try:
                 import pandas as pd
             except ImportError:
@@ -155,7 +161,7 @@ class PlotPreprocessor(markdown.preprocessors.Preprocessor):
             'div': textwrap.dedent(
                 '''
                     figure = go.Figure(data=[data], layout=layout)
-                    output = offline.plot(figure, output_type='div')
+                    output = plot_div(figure)
                 ''')
         }
 
@@ -167,6 +173,11 @@ class PlotMarkdownExtension(markdown.Extension):
         self.config = {
             'alt': ["plot", "Text to show when image is not available. Defaults to 'plot'."],
             'format': ["div", "Format of image to generate (div, png, svg). Defaults to 'div'."],
+            'plotly_js': ["inline-once", "How charts load plotly.js, once per document:"
+                                        " inline-once, cdn, file (in assets_dir) or none (loaded by the page)."],
+            'plotly_lazy': [False, "If true, charts are drawn when scrolled into view."],
+            'assets_dir': ["", "Directory where plotly.js is written with plotly_js=file."],
+            'assets_url': ["", "URL of assets_dir in the generated HTML."],
         }
         super().__init__(*args, **kwargs)
 
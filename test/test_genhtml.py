@@ -0,0 +1,689 @@
+"""Test the genhtml preprocessor on small inline documents"""
+
+import os
+import sys
+import textwrap
+from markdown import markdown as markdown_compiler
+from genhtml import GenHTMLMarkdownExtension
+
+
+def to_html(source:str, **config) -> str:
+    "Return the HTML compiled from given (dedented) markdown source"
+    extension = GenHTMLMarkdownExtension(**config)
+    return markdown_compiler(textwrap.dedent(source), extensions=[extension])
+
+
+def test_many_blocks_in_order():
+    source = '\n\n'.join(f"```genhtml header=none\nprint({idx})\n```" for idx in range(200))
+    html = to_html(source)
+    assert html == '\n'.join(f'<p>{idx}</p>' for idx in range(200))
+
+
+def test_nested_blocks_run_before_next_block():
+    html = to_html('''
+        ```genhtml header=none global-env=true
+        order = []
+        print('```genhtml header=none global-env=true\\norder.append(1)\\n```')
+        ```
+
+        ```genhtml header=none global-env=true
+        order.append(2)
+        print(order)
+        ```
+    ''')
+    assert html == '<p>[1, 2]</p>'
+
+
+def test_cache_reuses_outputs(tmp_path):
+    source = '''
+        ```genhtml header=none
+        import random
+        print(random.random())
+        ```
+    '''
+    first = to_html(source, cache_dir=str(tmp_path))
+    assert to_html(source, cache_dir=str(tmp_path)) == first
+    assert to_html(source.replace('none', 'none cache=false'), cache_dir=str(tmp_path)) != first
+
+
+def test_cache_dependencies(tmp_path):
+    datafile = tmp_path / 'data.txt'
+    datafile.write_text('a')
+    source = f'''
+        ```genhtml header=none cache-deps={tmp_path}/*.txt
+        print(open('{datafile}').read())
+        ```
+    '''
+    assert to_html(source, cache_dir=str(tmp_path / 'cache')) == '<p>a</p>'
+    datafile.write_text('b')
+    assert to_html(source, cache_dir=str(tmp_path / 'cache')) == '<p>b</p>'
+
+
+def test_cache_restores_env_writers(tmp_path):
+    source = '''
+        ```genhtml header=none
+        value = 1
+        ```
+
+        ```genhtml header=none global-env=true
+        print(value)
+        ```
+    '''
+    assert to_html(source, cache_dir=str(tmp_path)) == '<p>1</p>'
+    assert to_html(source, cache_dir=str(tmp_path)) == '<p>1</p>'
+
+
+def test_cache_follows_augmented_assignments(tmp_path):
+    source = '''
+        ```genhtml header=none
+        total = VALUE
+        ```
+
+        ```genhtml header=none global-env=true
+        total += 1
+        print(total)
+        ```
+    '''
+    assert to_html(source.replace('VALUE', '1'), cache_dir=str(tmp_path)) == '<p>2</p>'
+    assert to_html(source.replace('VALUE', '5'), cache_dir=str(tmp_path)) == '<p>6</p>'
+
+
+def test_cache_restores_mutated_values(tmp_path):
+    source = '''
+        ```genhtml header=none
+        data = [1]
+        ```
+
+        ```genhtml header=none global-env=true
+        data.append(2)
+        ```
+
+        ```genhtml header=none global-env=true
+        print(data, END)
+        ```
+    '''
+    assert to_html(source.replace('END', '1'), cache_dir=str(tmp_path)) == '<p>[1, 2] 1</p>'
+    assert to_html(source.replace('END', '2'), cache_dir=str(tmp_path)) == '<p>[1, 2] 2</p>'
+
+
+def test_cache_follows_functions_globals(tmp_path):
+    source = '''
+        ```genhtml header=none global-env=true
+        def f():
+            return x
+        ```
+
+        ```genhtml header=none global-env=true
+        x = VALUE
+        ```
+
+        ```genhtml header=none global-env=true
+        print(f())
+        ```
+    '''
+    for value in '232':
+        assert to_html(source.replace('VALUE', value), cache_dir=str(tmp_path)) == f'<p>{value}</p>'
+
+
+def test_cache_follows_functions_mutations(tmp_path):
+    import markdown
+    source = '''
+        ```genhtml header=none global-env=true
+        lst = []
+        def add():
+            lst.append(1)
+        ```
+
+        ```genhtml header=none global-env=true
+        CALLS
+        ```
+
+        ```genhtml header=none global-env=true
+        print(len(lst))
+        ```
+    '''
+    for calls in (1, 2, 3, 3):
+        md = markdown.Markdown(extensions=[GenHTMLMarkdownExtension(cache_dir=str(tmp_path))])
+        assert md.convert(textwrap.dedent(source.replace('CALLS', 'add();' * calls))) == f'<p>{calls}</p>'
+    assert [stats['cached'] for stats in md.genhtml_stats] == [False, True, True]  # add cannot be cached
+
+
+def test_cache_reruns_dependent_blocks_only(tmp_path):
+    import markdown
+
+    def cached_blocks(source:str) -> [bool]:
+        md = markdown.Markdown(extensions=[GenHTMLMarkdownExtension(cache_dir=str(tmp_path))])
+        md.convert(textwrap.dedent(source))
+        return [(block['cached'], block['depends_on']) for block in md.genhtml_stats]
+
+    source = '''
+        ```genhtml header=none
+        data = [1, 2, 3]
+        ```
+
+        ```genhtml header=none global-env=true
+        total = sum(data)
+        ```
+
+        ```genhtml header=none global-env=true
+        print(total * FACTOR)
+        ```
+    '''
+    first = source.replace('FACTOR', '1')
+    assert to_html(first, cache_dir=str(tmp_path)) == '<p>6</p>'
+    assert cached_blocks(first) == [(True, []), (True, [2]), (True, [6])]
+    assert to_html(source.replace('FACTOR', '2'), cache_dir=str(tmp_path)) == '<p>12</p>'
+    edited = first.replace('[1, 2, 3]', '[1, 2]')
+    assert to_html(edited, cache_dir=str(tmp_path)) == '<p>3</p>'
+    assert cached_blocks(edited) == [(True, []), (True, [2]), (True, [6])]
+
+
+def test_dependencies_analysis():
+    from genhtml.dependencies import analyze
+    reads, writes = analyze('import os\nx = y + 1\ndef f(a):\n    global z\n    z = a\n    return x + w\nprint(globals().get("v"))')
+    assert reads == {'y', 'w', 'v'} and writes == {'os', 'x', 'f', 'z'}
+    assert analyze('[i for i in items]') == ({'items'}, frozenset())
+    assert analyze('x += 1\ndel y') == ({'x', 'y'}, {'x', 'y'})
+
+
+def test_cache_eviction(tmp_path):
+    from genhtml.cache import BlockCache
+    cache = BlockCache(str(tmp_path), max_bytes=25)
+    cache.set('aa1', 'x' * 10)
+    cache.set('aa2', 'x' * 10)
+    cache.get('aa1')
+    os.utime(cache._path('aa2'), (0, 0))  # mtime resolution may not separate the two
+    cache.set('aa3', 'x' * 10)
+    assert cache.get('aa1') and cache.get('aa3') and cache.get('aa2') is None
+
+
+def test_workers_give_same_output():
+    source = '''
+        ```genhtml header=none
+        import os
+        value = os.getpid()
+        ```
+
+        ```genhtml header=none isolate-env=true
+        print('<b>isolated</b>')
+        ```
+
+        ```genhtml header=none global-env=true
+        print(value == __import__('os').getpid())
+        ```
+
+        ```genhtml header=none isolate-env=true
+        raise ValueError('in worker')
+        ```
+
+        ```genhtml header=none isolate-env=true format=png
+        import base64
+        print(base64.b64encode(b'data').decode())
+        ```
+    '''
+    assert to_html(source, workers=2) == to_html(source)
+    nested = '''
+        ```genhtml header=none
+        x = 41
+        ```
+
+        ```genhtml header=none
+        print('```genhtml header=none global-env=true\\nprint(x + 1)\\n```')
+        ```
+    '''
+    assert to_html(nested, workers=2) == to_html(nested) == '<p>42</p>'
+
+
+def test_warm_pool_runs_headers_once():
+    from genhtml.workers import WarmPool
+    pool = WarmPool(1, {'counter': 'import itertools\ncounter = itertools.count()'}, preload=['counter'])
+    run = lambda: pool.submit(('counter',), [('print(next(counter))', '<block>', False)], 'html', '', '').result()
+    assert [run()[:2], run()[:2]] == [('0\n', True), ('1\n', True)]
+    pool.max_blocks = 2  # third block is run by a new worker
+    assert run()[:2] == ('0\n', True)
+    pool.shutdown()
+    headers = {'default': 'import os\nprint(os.getpid(), end=" ")', '': 'import os\nprint(os.getpid(), end=" ")'}
+    pool = WarmPool(1, headers, preload=['default'])
+    run = lambda: pool.submit(('',), [('print(os.getpid())', '<block>', False)], 'html', '', '').result()[0]
+    pid, block_pid = run().split()
+    assert pid == block_pid and run() == f'{pid} {pid}\n'  # header printed in block output, by the same worker
+    pool.shutdown()
+
+
+def test_compile_many(tmp_path):
+    from genhtml import compile_many
+    sources = []
+    for idx in range(3):
+        sources.append(tmp_path / f'doc{idx}.mkd')
+        sources[-1].write_text(f'```genhtml header=none\nprint({idx})\n```\n')
+    paths = list(map(str, sources))
+    timings = compile_many(paths, str(tmp_path / 'out'), jobs=2)
+    assert all(timing is not None for timing in timings.values())
+    assert (tmp_path / 'out' / 'doc2.html').read_text() == '<p>2</p>'
+    os.utime(paths[1], (2**32, 2**32))  # doc1 is now newer than its output
+    timings = compile_many(paths, str(tmp_path / 'out'))
+    assert [timing is not None for timing in timings.values()] == [False, True, False]
+    for name in 'ab':
+        (tmp_path / name).mkdir()
+        (tmp_path / name / 'index.mkd').write_text(f'```genhtml header=none cache-deps={tmp_path}/{name}.csv\nprint("{name}")\n```\n')
+        (tmp_path / f'{name}.csv').write_text('1')
+    paths = [str(tmp_path / name / 'index.mkd') for name in 'ab']
+    compile_many(paths, str(tmp_path / 'out'))
+    assert [(tmp_path / 'out' / name / 'index.html').read_text() for name in 'ab'] == ['<p>a</p>', '<p>b</p>']
+    os.utime(tmp_path / 'b.csv', (2**32, 2**32))  # data read by b is newer than its output
+    assert [timing is not None for timing in compile_many(paths, str(tmp_path / 'out')).values()] == [False, True]
+
+
+def test_emit_bytes():
+    html = to_html('''
+        ```genhtml header=none alt=bytes
+        emit_bytes(b'GI')
+        emit_bytes(memoryview(b'F89a'), 'gif')
+        print('ignored')
+        ```
+    ''')
+    assert html == '<p><img src="data:image/gif;base64,R0lGODlh" alt="bytes" /></p>'
+
+
+def test_assets(tmp_path):
+    html = to_html('''
+        ```genhtml header=none format=png width=10
+        import base64
+        print(base64.b64encode(b'data').decode())
+        ```
+
+        ```genhtml header=none
+        emit_bytes(b'da')
+        emit_bytes(b'ta', 'png')
+        ```
+    ''', assets_dir=str(tmp_path), assets_url='/static/', assets_lazy=True)
+    assets = os.listdir(tmp_path)
+    assert len(assets) == 1 and (tmp_path / assets[0]).read_bytes() == b'data'
+    assert html == (f'<p><img src="/static/{assets[0]}" width="10" loading="lazy" /></p>\n'
+                    f'<p><img src="/static/{assets[0]}" loading="lazy" /></p>')
+    html = to_html('```genhtml header=none format=png\nprint("not base64!")\n```', assets_dir=str(tmp_path))
+    assert 'binascii.Error' in html and len(os.listdir(tmp_path)) == 1
+
+
+def test_isolated_env_copies_on_access():
+    html = to_html('''
+        ```genhtml header=none
+        import itertools
+        values, unused = [1], [2]
+        ```
+
+        ```genhtml header=none global-env=true isolate-env=true
+        def add(value):
+            values.append(value)
+        add(2)
+        del unused
+        print(values, 'unused' in globals(), next(itertools.count()))
+        ```
+
+        ```genhtml header=none global-env=true
+        print(values, unused)
+        ```
+    ''')
+    assert html == '<p>[1, 2] False 0</p>\n<p>[1] [2]</p>'
+
+
+def test_isolated_env_reports_copies():
+    from genhtml.environment import IsolatedEnv
+    parent = {'data': [1], 'module': os, 'lock': __import__('threading').Lock()}
+    env = IsolatedEnv(parent)
+    exec('data.append(2); module.getcwd(); lock', env, env)
+    assert parent['data'] == [1] and env['data'] == [1, 2]
+    assert env.copied == {'data'} and env.shared == {'lock'}
+
+
+def test_stats_and_profile_report(tmp_path):
+    import json
+    import markdown
+    md = markdown.Markdown(extensions=[GenHTMLMarkdownExtension(profile=True, profile_report=str(tmp_path / 'report.json'))])
+    md.convert(textwrap.dedent('''
+        Some text.
+
+        ```genhtml header=none footer=none
+        print('```genhtml header=none\\nprint(1)\\n```')
+        ```
+
+        ```genhtml interpret=false
+        print(2)
+        ```
+    '''))
+    lines = [(block['line'], block['exec_time'] is not None, block['peak_memory'] is not None)
+             for block in md.genhtml_stats]
+    assert lines == [(4, True, True), (4, True, True), (8, False, False)]
+    assert md.genhtml_stats[0]['headers'] == ['none'] and md.genhtml_stats[2]['output_size'] > 0
+    assert json.loads((tmp_path / 'report.json').read_text()) == md.genhtml_stats
+
+
+def test_compiled_stages(tmp_path):
+    source = '''
+        Text
+
+        ```genhtml footer=png-image
+        value = 1
+        raise ValueError(value)
+        ```
+    '''
+    html = to_html(source, cache_dir=str(tmp_path))
+    assert 'File "&lt;block line 4&gt;", line 2, in &lt;module&gt;' in html  # line of the block, then in the block
+    assert len(os.listdir(tmp_path / 'code')) == 2  # default header and png-image footer
+    to_html(source.replace('png-image', 'plot'))  # without cache directory: nothing written in the previous one
+    assert len(os.listdir(tmp_path / 'code')) == 2
+    to_html(source.replace('png-image', 'plot'), cache_dir=str(tmp_path / 'other'))
+    assert len(os.listdir(tmp_path / 'code')) == 2 and len(os.listdir(tmp_path / 'other' / 'code')) == 2
+
+
+def test_lazy_import():
+    import sys
+    import pytest
+    import subprocess
+    from genhtml.lazy import lazy_import
+    sys.modules.pop('colorsys', None)
+    colorsys = lazy_import('colorsys')
+    assert 'colorsys' not in sys.modules
+    assert colorsys.rgb_to_hsv(0, 0, 0) == (0, 0, 0)
+    assert 'colorsys' in sys.modules
+    with pytest.raises(ImportError):
+        lazy_import('not_a_genhtml_module')
+    slow = ['multiprocessing', 'concurrent.futures', 'asyncio', 'argparse', 'pickle', 'ast', 'uuid']
+    code = f"import sys, markdown, genhtml; print(sorted(set({slow}) & sys.modules.keys()))"
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    assert subprocess.run([sys.executable, '-c', code], cwd=root, stdout=subprocess.PIPE, check=True).stdout == b'[]\n'
+
+
+def test_async_render_captures_output_per_task():
+    import asyncio
+    from genhtml import render
+    source = '''
+        ```genhtml header=none
+        import time
+        for idx in range({}):
+            print(idx, end=' ')
+            time.sleep(0.001)
+        ```
+    '''
+
+    async def render_all():
+        return await asyncio.gather(*(render(textwrap.dedent(source.format(size))) for size in range(1, 9)))
+
+    stdout = sys.stdout
+    assert asyncio.run(render_all()) == [to_html(source.format(size)) for size in range(1, 9)]
+    assert sys.stdout is stdout
+    from genhtml import aio
+    previous = aio.MAX_CONCURRENCY
+    aio.set_max_concurrency(2)
+    try:
+        assert asyncio.run(render_all()) == [to_html(source.format(size)) for size in range(1, 9)]
+        assert aio._executor._max_workers == 2
+    finally:
+        aio.set_max_concurrency(previous)
+
+
+def test_graphviz_renders_each_graph_once(tmp_path):
+    import shutil
+    import pytest
+    from genhtml import graphviz
+    if not shutil.which('dot'):
+        pytest.skip("graphviz is not installed")
+    sources = ['digraph { a -> b }', 'digraph { b -> c }', 'digraph { a -> b }']
+    svgs = graphviz.render_many(sources, 'svg', directory=str(tmp_path))
+    assert svgs[0] == svgs[2] != svgs[1] and b'<svg' in svgs[1]
+    graphviz._memory.clear()
+    assert graphviz.render(sources[1], 'svg', directory=str(tmp_path)) == svgs[1]  # read from disk
+
+
+def test_graphs_rendered_once_per_document(monkeypatch):
+    from genhtml import graphviz
+    calls = []
+
+    def run_graphviz(sources, format, program):  # stands for the graphviz executable
+        calls.append((len(sources), format))
+        return [f'<?xml?><svg>{source}</svg>'.encode() if format == 'svg' else source.encode() for source in sources]
+
+    monkeypatch.setattr(graphviz, '_run_graphviz', run_graphviz)
+    graphviz._memory.clear()
+    blocks = [f'```genhtml header=none footer={footer} format=png alt=g{idx}\ngraph = "digraph {{ {idx} }}"\n```'
+              for idx in range(3) for footer in ('dot-png', 'dot-svg')]
+    blocks.append('```genmark header=none footer=dot-svg\ngraph = "digraph { 0 }"\n```')
+    html = to_html('\n\n'.join(blocks), workers=2)
+    assert sorted(calls) == [(3, 'png'), (3, 'svg')]
+    assert html.count('<svg>digraph { 0 }</svg>') == 2 and '<?xml' not in html and 'genhtml-graph' not in html
+    assert html.count('<img src="data:image/png;base64,') == 3 and 'alt="g2"' in html
+    graphviz._memory.clear()
+
+
+def test_block_limits():
+    html = to_html('''
+        ```genhtml header=none global-env=true timeout=0.5
+        values = [1]
+        ```
+
+        ```genhtml header=none global-env=true timeout=0.5
+        values.append(2)
+        while True:
+            pass
+        ```
+
+        ```genhtml header=none memory=50
+        data = bytearray(200 * 2**20)
+        ```
+
+        ```genhtml header=none global-env=true
+        print(values)
+        ```
+    ''', block_timeout=10)
+    assert 'TimeoutError: Code did not complete within 0.5 seconds' in html
+    assert 'MemoryError' in html
+    assert html.endswith('<p>[1]</p>')
+
+
+def test_generate_html():
+    import markdown
+    preprocessor = markdown.Markdown(extensions=[GenHTMLMarkdownExtension()]).preprocessors['genhtml']
+    assert preprocessor.generate_html('x = 1\nprint(x)', 'html', True, False, '', '') == '1\n'
+    assert preprocessor.generate_html('print(x + 1)', 'html', True, True, '', '') == '2\n'
+
+
+def test_subprocess_executor():
+    html = to_html('''
+        ```genhtml header=none global-env=true
+        import os
+        values = [os.getpid()]
+        print(values[0] != PARENT)
+        ```
+
+        ```genhtml header=none global-env=true
+        print(len(values))
+        ```
+
+        ```genhtml header=none
+        import os
+        os._exit(3)
+        ```
+
+        ```genhtml header=none
+        print('x' * 100000)
+        ```
+    '''.replace('PARENT', str(os.getpid())), executor='subprocess')
+    assert html.startswith('<p>True</p>\n<p>1</p>')
+    assert 'ChildProcessError: Executor process died with exit code 3' in html
+    assert html.endswith(f"<p>{'x' * 100000}</p>")
+
+
+def test_executor_processes_stopped(tmp_path):
+    import gc
+    import glob
+    import tempfile
+    import markdown
+    import multiprocessing
+    from genhtml import compile_many
+    from genhtml.executors import SHM_DIR
+    pattern = os.path.join(SHM_DIR or tempfile.gettempdir(), 'genhtml-*')
+    gc.collect()
+    files, children = set(glob.glob(pattern)), set(multiprocessing.active_children())
+    block = '```genhtml header=none global-env=true\nprint(1)\n```\n\n```genhtml header=none\nprint(2)\n```'
+    for _ in range(3):
+        assert to_html(block, executor='subprocess') == '<p>1</p>\n<p>2</p>'
+    gc.collect()
+    assert set(glob.glob(pattern)) <= files and set(multiprocessing.active_children()) <= children
+    md = markdown.Markdown(extensions=[GenHTMLMarkdownExtension(executor='forkserver', workers=2)])
+    assert md.convert(block) == '<p>1</p>\n<p>2</p>' and set(multiprocessing.active_children()) > children
+    md.preprocessors['genhtml'].close()
+    assert set(glob.glob(pattern)) <= files and set(multiprocessing.active_children()) <= children
+    (tmp_path / 'doc.mkd').write_text(block)
+    compile_many([str(tmp_path / 'doc.mkd')], str(tmp_path / 'out'), config={'executor': 'subprocess'})
+    assert set(glob.glob(pattern)) <= files and set(multiprocessing.active_children()) <= children
+
+
+def test_index_blocks_without_running_them():
+    import markdown
+    md = markdown.Markdown(extensions=[GenHTMLMarkdownExtension()])
+    preprocessor = md.preprocessors['genhtml']
+    specs = preprocessor.index(textwrap.dedent('''
+        Text
+
+        ```genhtml header=none,graph footer=dot-png global-env=true timeout=2 unknown=1
+        raise ValueError()
+        ```
+
+        ```genhtml format=nope cache=false
+        pass
+        ```
+    '''))
+    assert [spec.line for spec in specs] == [4, 8]
+    assert specs[0].headers == ('none', 'graph') and specs[0].footers == ('dot-png',)
+    assert specs[0].global_env and specs[0].timeout == 2 and specs[1].timeout is None
+    assert specs[1].format == 'html' and not specs[1].cache and specs[0].source_hash != specs[1].source_hash
+    assert not hasattr(specs[0], '__dict__')
+
+
+def test_image_processing(tmp_path):
+    import re
+    import base64
+    import io
+    from PIL import Image
+    source = '''
+        ```genhtml header=none footer=png-image format=webp max-width=100 srcset=50,25 quality=50
+        from PIL import Image
+        image = Image.new('RGB', (400, 200), 'beige')
+        ```
+    '''
+    html = to_html(source, cache_dir=str(tmp_path))
+    sources = re.findall(r'data:image/webp;base64,([^ "]+)', html)
+    sizes = [Image.open(io.BytesIO(base64.b64decode(data))).size for data in sources]
+    assert sizes == [(100, 50), (100, 50), (50, 25), (25, 12)]  # src, then srcset
+    assert 'srcset="data:image/webp;base64,' in html and ' 50w, ' in html
+    html = to_html(source, assets_dir=str(tmp_path / 'assets'))
+    names = sorted(os.listdir(tmp_path / 'assets'))
+    assert len(names) == 3 and all(name.endswith('.webp') for name in names) and html.count('.webp') == 4
+    html = to_html('''
+        ```genhtml header=none format=png max-width=10
+        print('aGVsbG8=')
+        ```
+
+        ```genhtml header=none footer=png-image format=webp quality=500
+        from PIL import Image
+        image = Image.new('RGB', (40, 20), 'beige')
+        ```
+    ''')
+    assert 'UnidentifiedImageError' in html and html.count('Traceback') == 1  # invalid quality is ignored
+    assert html.endswith('" /></p>') and 'data:image/webp;base64,' in html
+
+
+def test_data_loaded_once(tmp_path):
+    import pytest
+    pytest.importorskip('pandas')
+    from genhtml import data
+    (tmp_path / 'values.csv').write_text('a,b\n1,2\n3,4\n')
+    source = f'''
+        ```genhtml header=none isolate-env=true cache=false
+        frame = data.load('{tmp_path}/values.csv')
+        frame['c'] = frame.a + frame.b
+        print(list(frame.c))
+        ```
+
+        ```genhtml header=none cache=false
+        print(list(data.load('{tmp_path}/values.csv').columns), id(data.load('{tmp_path}/values.csv').a))
+        ```
+    '''
+    html = to_html(source, cache_dir=str(tmp_path / 'cache'))
+    assert html.startswith("<p>[3, 7]</p>\n<p>['a', 'b'] ")
+    assert len(os.listdir(tmp_path / 'cache' / 'data')) == 1
+    data._loaded.clear()  # as in another process: read from the Arrow cache
+    assert to_html(source, cache_dir=str(tmp_path / 'cache')).startswith("<p>[3, 7]</p>\n<p>['a', 'b'] ")
+    assert len(data._loaded) == 1
+    for idx in range(3):  # new versions replace the previous one in memory
+        (tmp_path / 'versions.csv').write_text(f'a,b\n{idx},2\n')
+        os.utime(tmp_path / 'versions.csv', ns=(idx, idx))
+        assert list(data.load(tmp_path / 'versions.csv').a) == [idx]
+    assert len(data._loaded) == 2
+    assert to_html('```genhtml header=none global-env=true\ndata = 1\n```\n\n'
+                   '```genhtml header=none global-env=true\nprint(data)\n```') == '<p>1</p>'
+    function = f"```genhtml header=none global-env=true\ndef total():\n    return data.load('{tmp_path}/values.csv').a.sum()\n```"
+    isolated = '```genhtml header=none global-env=true isolate-env=true cache=false\nprint(total())\n```'
+    assert to_html(function + '\n\n' + isolated) == '<p>4</p>'
+
+
+def test_pure_blocks_run_once_per_build():
+    import markdown
+    block = '```genhtml header=none pure=true\nimport random\nprint(random.random())\n```'
+    md = markdown.Markdown(extensions=[GenHTMLMarkdownExtension()])
+    first = md.convert('\n\n'.join([block] * 3))
+    md.reset()
+    second = md.convert(block + '\n\n' + block.replace('pure=true', 'pure=false'))
+    outputs = first.split('\n') + second.split('\n')
+    assert len(set(outputs)) == 2 and outputs[-1] not in outputs[:-1]
+    assert [stats['reused'] for stats in md.genhtml_stats] == [True, False]
+    assert md.preprocessors['genhtml'].reused == 3
+    html = to_html('\n\n'.join([block] * 4), workers=2)
+    assert len(set(html.split('\n'))) == 1
+
+
+def test_plotly_js_included_once(tmp_path):
+    import pytest
+    pytest.importorskip('plotly')
+    block = '''```genhtml footer=plot
+data = go.Scatter(x=[1, 2], y=[2, 1])
+layout = go.Layout(title="</script>")
+```'''
+    html = to_html('\n\n'.join([block] * 3))
+    assert html.count('<div class="genhtml-plotly"') == 3 and html.count('<script type="text/javascript">') == 1
+    assert html.index('<script type="text/javascript">') < html.index('<div class="genhtml-plotly"')
+    assert '"</script>"' not in html
+    html = to_html(block, plotly_js='file', plotly_lazy=True, assets_dir=str(tmp_path), assets_url='/static')
+    assert os.listdir(tmp_path)[0].startswith('plotly-') and '<script src="/static/plotly-' in html
+    assert 'if (true &&' in html and len(to_html(block, plotly_js='cdn')) < 20000
+    html = to_html('\n\n'.join([block.replace('genhtml', 'genmark')] * 2 + [block]))
+    assert html.count('<div class="genhtml-plotly"') == 3 and html.count('<script type="text/javascript">') == 1
+    assert html.index('<script type="text/javascript">') < html.index('<div class="genhtml-plotly"')
+    assert html.count('Plotly.newPlot(div') == 1
+
+
+def test_markdown_outputs_converted_on_their_own():
+    import markdown
+    source = '''
+        ```genmark header=none
+        print('* item *one*')
+        print('```genhtml header=none\\nprint("* nested")\\n```')
+        ```
+
+        ```genhtml header=none format=markdown
+        print('| a |\\n|---|\\n| 1 |')
+        ```
+
+        ```genhtml header=none
+        print('* raw')
+        ```
+    '''
+    md = markdown.Markdown(extensions=['markdown.extensions.tables', GenHTMLMarkdownExtension()])
+    html = md.convert(textwrap.dedent(source))
+    assert html.startswith('<ul>\n<li>item <em>one</em></li>\n<li>nested</li>\n</ul>\n\n<table>')
+    assert html.endswith('</table>\n\n<ul>\n<li>raw</li>\n</ul>')
+    assert md.htmlStash.html_counter == 2  # nested outputs are converted with their parent
+    assert '<table>' not in to_html(source, fragment_extensions='markdown.extensions.abbr')
+    assert '<table>' not in to_html(source, fragment_extensions='')
+    md = markdown.Markdown(extensions=[GenHTMLMarkdownExtension()])
+    assert '<table>' in md.convert(textwrap.dedent(source))  # markdown.extensions.extra by default